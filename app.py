@@ -1,16 +1,64 @@
-from flask import Flask, request, jsonify, render_template
-from flasgger import Swagger, swag_from
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Index, DateTime
+from flask import Blueprint, Flask, Response, current_app, g, has_request_context, request, jsonify, make_response, render_template, stream_template, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask.logging import default_handler
+from werkzeug.wsgi import ClosingIterator
+from sqlalchemy import create_engine, event, insert, update, delete, any_, bindparam, case, cast, func, literal, or_, tuple_, ARRAY, Text, Column, Integer, BigInteger, String, ForeignKey, Index, DateTime, Date, Float, union_all, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array as pg_array
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.sql import select, join
 from sqlalchemy.sql import text
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import wraps
 from dotenv import load_dotenv
+import argparse
+import hashlib
+import io
+import json
+import logging
+import queue
+import select as select_module
+import sys
+import zlib
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import chain, count, islice
+from operator import itemgetter
+from urllib.parse import urlencode
+import heapq
 
-app = Flask(__name__, template_folder='templates', static_folder='static')
+try:
+    import orjson
+except ImportError:  # Opcional: sem ele o app usa o provedor JSON padrão do Flask
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # Opcional: compressão zstd
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # Opcional: compressão brotli
+    brotli = None
+
+# As rotas ficam num blueprint; create_app() monta a aplicação. Importar este módulo não cria o app,
+# não gera a documentação e não toca no banco
+api = Blueprint("incidents", __name__)
+logger = logging.getLogger("incidents")
+
+def swag_from(specs):
+    # Equivalente ao swag_from do flasgger para especificações em dict (sem validação): a especificação
+    # fica na função e o flasgger só é importado por create_app quando a documentação está ligada
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
 
 # Configuração do Swagger (permanece inalterada)
 swagger_config = {
@@ -64,8 +112,6 @@ template = {
     }
 }
 
-swagger = Swagger(app, config=swagger_config, template=template)
-
 # Configuração do SQLAlchemy
 load_dotenv()
 
@@ -76,7 +122,40 @@ DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
 DB_URL = f"postgresql+psycopg2://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-print(DB_URL)
+# Configuração do JSON: orjson quando disponível (JSON_PROVIDER=auto|orjson|default).
+# JSON_DATETIME_FORMAT=http mantém as datas no formato padrão do Flask; iso usa o formato nativo do orjson.
+JSON_PROVIDER = os.getenv("JSON_PROVIDER", "auto")
+JSON_DATETIME_FORMAT = os.getenv("JSON_DATETIME_FORMAT", "http")
+
+class OrjsonProvider(DefaultJSONProvider):
+    def __init__(self, app, datetime_format="http"):
+        super().__init__(app)
+        self.option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            self.option |= orjson.OPT_SORT_KEYS
+        if datetime_format == "http":
+            # Datas passam pelo default() do Flask (http_date) em vez do ISO nativo
+            self.option |= orjson.OPT_PASSTHROUGH_DATETIME
+        self.datetime_format = datetime_format
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self.option
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        body = orjson.dumps(obj, default=self.default, option=option) + b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 Base = declarative_base()
 
 # Modelos
@@ -91,18 +170,35 @@ class Incident(Base):
     end_date = Column(DateTime)
     time_range = Column(String, nullable=False)
     type_service = Column(String, nullable=False)
-    affected_services = relationship("AffectedService", back_populates="incident")
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Concorrência otimista (ETag)
+    # passive_deletes: o banco remove os serviços (ON DELETE CASCADE), o ORM não carrega nem anula os filhos
+    affected_services = relationship("AffectedService", back_populates="incident",
+                                     cascade="all, delete-orphan", passive_deletes=True)
 
 class AffectedService(Base):
     __tablename__ = 'affected_services'
     __table_args__ = {'schema': 'network'}  # Especifica o schema
     
     id = Column(Integer, primary_key=True)
-    incident_id = Column(Integer, ForeignKey('network.incidents.id'))  # Referencia o schema
+    incident_id = Column(Integer, ForeignKey('network.incidents.id', ondelete='CASCADE'))  # Referencia o schema
     service_id = Column(String, nullable=False)
     incident = relationship("Incident", back_populates="affected_services")
 
-Index('idx_service_id', AffectedService.service_id)
+# Índices dos caminhos de acesso da API
+Index('idx_service_incident', AffectedService.service_id, AffectedService.incident_id)
+Index('idx_incident_open', Incident.id, postgresql_where=Incident.end_date.is_(None))  # Incidentes em andamento
+Index('idx_incident_start_date', Incident.start_date, Incident.id)  # Janelas de datas e sort=start_date
+Index('idx_incident_issue_type', Incident.issue_type, Incident.start_date)
+# Chave natural: reenvios do mesmo alarme caem no mesmo incidente (ON CONFLICT em upsert_incident)
+Index('uq_incident_natural_key', Incident.element, Incident.issue_type, Incident.start_date, unique=True)
+Index('uq_affected_incident_service', AffectedService.incident_id, AffectedService.service_id, unique=True)
+# Cobertos pelos índices acima (mesmas colunas iniciais) ou substituídos por idx_service_incident;
+# removidos de bancos existentes por create_database
+REDUNDANT_INDEXES = ('idx_affected_incident_id', 'idx_incident_element', 'idx_service_id')
+# Busca por prefixo (LIKE 'abc%') sem diferenciar maiúsculas; text_pattern_ops vale em qualquer collation.
+# O índice de trigramas (idx_incident_element_trgm) depende do pg_trgm e é criado em create_database
+Index('idx_incident_element_prefix', func.lower(Incident.element).label('element_lower'),
+      postgresql_ops={'element_lower': 'text_pattern_ops'})
 
 class HistoricIncident(Base):
     __tablename__ = 'historic_incidents'
@@ -116,133 +212,1248 @@ class HistoricIncident(Base):
     time_range = Column(String, nullable=False)
     type_service = Column(String, nullable=False)
 
-def connect_database():
+class HistoricAffectedService(Base):
+    __tablename__ = 'historic_affected_services'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+    
+    id = Column(Integer, primary_key=True)
+    incident_id = Column(Integer, nullable=False)  # Sem FK: historic_incidents pode ser particionada
+    service_id = Column(String, nullable=False)
+
+# Versão dos dados, incrementada na mesma transação de cada escrita (base dos ETags)
+class DataVersion(Base):
+    __tablename__ = 'data_versions'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+    
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False)
+
+# Rollups diários para estatísticas: recalculados só para os dias marcados como alterados
+class IncidentRollup(Base):
+    __tablename__ = 'incident_rollups'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+
+    bucket = Column(Date, primary_key=True)
+    element = Column(String, primary_key=True)
+    issue_type = Column(String, primary_key=True)
+    type_service = Column(String, primary_key=True)
+    incidents = Column(Integer, nullable=False)
+    closed = Column(Integer, nullable=False)
+    duration_seconds = Column(Float, nullable=False)  # Soma das durações dos encerrados
+    duration_histogram = Column(ARRAY(Integer), nullable=False)  # Contagens por faixa de STATS_DURATION_BOUNDS
+
+class ServiceRollup(Base):
+    __tablename__ = 'service_rollups'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+
+    bucket = Column(Date, primary_key=True)
+    service_id = Column(String, primary_key=True)
+    incidents = Column(Integer, nullable=False)
+    closed = Column(Integer, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+    duration_histogram = Column(ARRAY(Integer), nullable=False)
+
+class RollupDirtyBucket(Base):
+    __tablename__ = 'rollup_dirty_buckets'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+
+    bucket = Column(Date, primary_key=True)
+
+# Dias retirados de rollup_dirty_buckets por um refresh e ainda não recalculados (só o refresh escreve aqui)
+class RollupClaimedBucket(Base):
+    __tablename__ = 'rollup_claimed_buckets'
+    __table_args__ = {'schema': 'network'}  # Especifica o schema
+
+    bucket = Column(Date, primary_key=True)
+
+Index('idx_historic_service_incident', HistoricAffectedService.service_id, HistoricAffectedService.incident_id)
+Index('idx_historic_affected_incident_id', HistoricAffectedService.incident_id)
+Index('idx_historic_start_date', HistoricIncident.start_date)  # Recalculo dos rollups por dia
+
+def env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+# Configuração do pool de conexões (um engine por processo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+DB_CREATE_SCHEMA = env_flag("DB_CREATE_SCHEMA", False)
+# SWAGGER_ENABLED=false (produção) não importa o flasgger nem registra /apidocs e /apispec_1.json
+SWAGGER_ENABLED = env_flag("SWAGGER_ENABLED", True)
+
+# Arquivamento de incidentes encerrados em historic_incidents
+ARCHIVE_ENABLED = env_flag("ARCHIVE_ENABLED", False)
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "300"))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.1"))
+HISTORIC_PARTITIONED = env_flag("HISTORIC_PARTITIONED", False)
+
+# Métricas no formato texto do Prometheus. Os valores são por processo: com vários workers do
+# gunicorn cada scrape responde pelo worker que atendeu a requisição
+METRICS_ENABLED = env_flag("METRICS_ENABLED", True)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))  # 0 desliga o log de consultas lentas
+SERVER_TIMING = env_flag("SERVER_TIMING", False)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _sample_name(name, labels, values, extra=()):
+    pairs = [f'{label}="{_label_value(value)}"' for label, value in chain(zip(labels, values), extra)]
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            samples = sorted(self._values.items())
+        for values, value in samples:
+            yield f"{_sample_name(self.name, self.labels, values)} {value}"
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, amount, *values):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += amount
+            series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            samples = sorted((values, (list(series[0]), series[1], series[2])) for values, series in self._series.items())
+        for values, (counts, total, count) in samples:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                yield f"{_sample_name(self.name + '_bucket', self.labels, values, [('le', bound)])} {cumulative}"
+            yield f"{_sample_name(self.name + '_bucket', self.labels, values, [('le', '+Inf')])} {count}"
+            yield f"{_sample_name(self.name + '_sum', self.labels, values)} {total}"
+            yield f"{_sample_name(self.name + '_count', self.labels, values)} {count}"
+
+class Gauge:
+    # Lida no momento do scrape
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency, including streamed bodies",
+                         ("method", "route"))
+HTTP_DB_STATEMENTS = Histogram("http_request_db_statements", "SQL statements executed per HTTP request",
+                               ("route",), STATEMENT_BUCKETS)
+HTTP_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL per HTTP request", ("route",))
+HTTP_SERIALIZE_SECONDS = Histogram("http_request_serialize_seconds", "Time spent encoding JSON per HTTP request",
+                                   ("route",))
+DB_STATEMENT_SECONDS = Histogram("db_statement_duration_seconds", "SQL statement latency by statement type",
+                                 ("statement",))
+DB_SLOW_STATEMENTS = Counter("db_slow_statements_total", "SQL statements slower than SLOW_QUERY_MS", ("statement",))
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool")
+DB_POOL_CONNECTS = Counter("db_pool_connects_total", "New DBAPI connections opened by the pool")
+DB_POOL_WAITS = Counter("db_pool_waits_total", "Checkouts that found the pool exhausted and had to wait")
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT")
+DB_POOL_WAIT_SECONDS = Histogram("db_pool_checkout_seconds", "Time to obtain a connection from the pool")
+DB_READS = Counter("db_reads_total", "Read engine selections (replica host or primary)", ("target",))
+
+_request_metrics = threading.local()
+
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        # Sem conexões livres e sem folga de overflow a chamada bloqueia até alguém devolver uma
+        exhausted = self.checkedin() == 0 and self.overflow() >= DB_MAX_OVERFLOW
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+            if exhausted:
+                DB_POOL_WAITS.inc()
+
+def _statement_type(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    kind = _statement_type(statement)
+    DB_STATEMENT_SECONDS.observe(elapsed, kind)
+    if getattr(_request_metrics, "active", False):
+        _request_metrics.db_statements += 1
+        _request_metrics.db_seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        DB_SLOW_STATEMENTS.inc(kind)
+        # Só o texto parametrizado: os valores (nomes, serviços, datas) nunca vão para o log
+        count = len(parameters) if isinstance(parameters, (list, tuple, dict)) else 0
+        logger.warning("Consulta lenta (%.1f ms, %s parâmetros omitidos%s): %s",
+                           elapsed * 1000, count, ", executemany" if executemany else "", " ".join(statement.split()))
+
+def _instrument_engine(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.pool, "checkout", lambda *args: DB_POOL_CHECKOUTS.inc())
+    event.listen(engine.pool, "connect", lambda *args: DB_POOL_CONNECTS.inc())
+
+def _create_engine(url, **options):
+    engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        poolclass=InstrumentedQueuePool if METRICS_ENABLED else QueuePool,
+        **options
+    )
+    if METRICS_ENABLED:
+        _instrument_engine(engine)
+    return engine
+
+_engine = None
+_Session = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine, _Session, _engine_pid
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
+    with _engine_lock:
+        if _engine is None or _engine_pid != pid:
+            if _engine is not None:
+                # Processo filho (fork): abandona as conexões herdadas sem fechá-las no pai
+                _engine.dispose(close=False)
+            _engine = _create_engine(DB_URL)
+            _Session = sessionmaker(bind=_engine)
+            _engine_pid = pid
+    return _engine
+
+def dispose_engine():
+    global _engine, _Session, _engine_pid, _replicas, _replicas_pid
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose(close=_engine_pid == os.getpid())
+        for replica in _replicas or ():
+            replica.engine.dispose(close=_replicas_pid == os.getpid())
+        _engine = None
+        _Session = None
+        _engine_pid = None
+        _replicas = None
+        _replicas_pid = None
+
+def _reset_engine_after_fork():
+    global _engine_lock
+    _engine_lock = threading.Lock()
+    dispose_engine()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+def connect_database(read_only=False):
     try:
-        engine = create_engine(DB_URL)
-        Session = sessionmaker(bind=engine)
-        Base.metadata.create_all(engine)
-        return Session, engine
+        engine = get_read_engine() if read_only else get_engine()
+        return _Session, engine
     except Exception as e:
         raise Exception(f"Erro ao configurar o banco de dados: {e}")    
 
-# Criação das tabelas
+# Réplicas de leitura (DB_REPLICA_URLS, separadas por vírgula). As consultas das rotas GET vão para uma
+# réplica em round-robin; réplicas fora do ar ou com atraso acima de DB_REPLICA_MAX_LAG segundos ficam de
+# fora e a leitura volta para o primário. Escritas, arquivamento, LISTEN e estatísticas usam sempre o primário
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "2"))
+# Leia-suas-escritas: depois de uma escrita a resposta leva a posição do WAL no primário (cabeçalho e cookie);
+# leituras que a enviam de volta só usam réplicas que já reproduziram essa posição
+READ_YOUR_WRITES_HEADER = "X-Incidents-LSN"
+READ_YOUR_WRITES_COOKIE = os.getenv("READ_YOUR_WRITES_COOKIE", "incidents_lsn")
+READ_YOUR_WRITES_TTL = int(os.getenv("READ_YOUR_WRITES_TTL", "60"))
+
+# Sem streaming (pg_last_wal_receive_lsn nulo) ou com WAL pendente, o atraso é a idade da última transação
+# reproduzida; uma réplica ociosa e em dia tem atraso zero. Um servidor que não está em recovery não atrasa
+REPLICA_STATUS_SQL = text("""
+    SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END AS lag,
+           CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END::text AS lsn
+""")
+
+def parse_lsn(value):
+    try:
+        high, low = value.split("/")
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        return 0
+
+class ReadReplica:
+    def __init__(self, url):
+        self.engine = _create_engine(url, connect_args={"connect_timeout": DB_REPLICA_CONNECT_TIMEOUT})
+        url = self.engine.url
+        self.name = f"{url.host or url.query.get('host', 'localhost')}:{url.port or 5432}"
+        self.lag = None
+        self.lsn = 0
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            with self.engine.connect() as conn:
+                row = conn.execute(REPLICA_STATUS_SQL).one()
+            self.lag, self.lsn = float(row.lag), parse_lsn(row.lsn)
+        except Exception as e:
+            if self.lag is not None:
+                logger.warning("Réplica %s indisponível: %s", self.name, e)
+            self.lag = None
+        self.checked_at = time.monotonic()
+
+    def usable(self, min_lsn=0):
+        # Só uma thread consulta o estado por vez; as demais usam o último valor medido
+        checked_at = self.checked_at
+        if (checked_at is None or time.monotonic() - checked_at >= DB_REPLICA_CHECK_INTERVAL) \
+                and self._lock.acquire(blocking=False):
+            try:
+                self.refresh()
+            finally:
+                self._lock.release()
+        return self.lag is not None and self.lag <= DB_REPLICA_MAX_LAG and self.lsn >= min_lsn
+
+_replicas = None
+_replicas_pid = None
+_replica_turn = count()
+
+def get_replicas():
+    global _replicas, _replicas_pid
+    pid = os.getpid()
+    if _replicas is not None and _replicas_pid == pid:
+        return _replicas
+    with _engine_lock:
+        if _replicas is None or _replicas_pid != pid:
+            _replicas = [ReadReplica(url) for url in DB_REPLICA_URLS]
+            _replicas_pid = pid
+    return _replicas
+
+def _choose_read_engine(min_lsn=0):
+    replicas = get_replicas()
+    if replicas:
+        start = next(_replica_turn)
+        for offset in range(len(replicas)):
+            replica = replicas[(start + offset) % len(replicas)]
+            if replica.usable(min_lsn):
+                DB_READS.inc(replica.name)
+                return replica.engine
+    DB_READS.inc("primary")
+    return get_engine()
+
+def _required_lsn():
+    return parse_lsn(request.headers.get(READ_YOUR_WRITES_HEADER) or request.cookies.get(READ_YOUR_WRITES_COOKIE))
+
+def get_read_engine():
+    if not DB_REPLICA_URLS:
+        return get_engine()
+    if not has_request_context():
+        return _choose_read_engine()
+    if g.get("wrote"):
+        # A própria requisição escreveu: lê do primário
+        return get_engine()
+    # Uma escolha por requisição: o ETag (get_data_version) e os dados saem do mesmo servidor
+    if "read_engine" not in g:
+        g.read_engine = _choose_read_engine(_required_lsn())
+    return g.read_engine
+
+# Criação das tabelas (executar uma vez: `python app.py init-db` ou DB_CREATE_SCHEMA=true)
+# Bancos criados antes do ON DELETE CASCADE: troca a FK e remove os serviços órfãos que o ORM deixava
+FK_CASCADE_MIGRATION_SQL = text("""
+    DO $$
+    DECLARE fk record;
+    BEGIN
+        FOR fk IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = 'network.affected_services'::regclass AND contype = 'f'
+              AND confrelid = 'network.incidents'::regclass AND confdeltype <> 'c'
+        LOOP
+            DELETE FROM network.affected_services WHERE incident_id IS NULL;
+            EXECUTE format('ALTER TABLE network.affected_services DROP CONSTRAINT %I', fk.conname);
+            ALTER TABLE network.affected_services ADD CONSTRAINT affected_services_incident_id_fkey
+                FOREIGN KEY (incident_id) REFERENCES network.incidents (id) ON DELETE CASCADE;
+        END LOOP;
+    END $$
+""")
+
+# Antes dos índices únicos: funde os incidentes duplicados no de menor id (serviços e data de fim mais recente)
+# e remove serviços repetidos. Só roda enquanto uq_incident_natural_key não existe
+DUPLICATE_INCIDENTS_SQL = """
+    WITH groups AS (
+        SELECT min(id) AS keep_id, array_agg(id) AS ids, max(end_date) AS end_date,
+               (array_agg(time_range ORDER BY end_date DESC NULLS LAST, id DESC))[1] AS time_range
+        FROM network.incidents
+        GROUP BY element, issue_type, start_date
+        HAVING count(*) > 1
+    )
+"""
+DEDUPLICATE_INCIDENTS_SQL = [text(DUPLICATE_INCIDENTS_SQL + statement) for statement in ("""
+    UPDATE network.affected_services s SET incident_id = g.keep_id
+    FROM groups g WHERE s.incident_id = ANY(g.ids) AND s.incident_id <> g.keep_id
+""", """
+    UPDATE network.incidents i SET end_date = g.end_date, time_range = g.time_range, version = i.version + 1
+    FROM groups g WHERE i.id = g.keep_id
+""", """
+    DELETE FROM network.incidents i USING groups g WHERE i.id = ANY(g.ids) AND i.id <> g.keep_id
+""")] + [text("""
+    DELETE FROM network.affected_services s
+    USING network.affected_services kept
+    WHERE kept.incident_id = s.incident_id AND kept.service_id = s.service_id AND kept.id < s.id
+""")]
+
+# Triggers de nível de instrução marcam os dias (start_date) cujos rollups ficaram desatualizados.
+# Cobrem qualquer escrita, inclusive SQL manual e o arquivamento (DELETE em incidents)
+ROLLUP_TRIGGERS_SQL = [text(statement) for statement in ("""
+    CREATE OR REPLACE FUNCTION network.mark_rollup_buckets() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'incidents' THEN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                INSERT INTO network.rollup_dirty_buckets (bucket)
+                SELECT DISTINCT start_date::date FROM old_rows ON CONFLICT DO NOTHING;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO network.rollup_dirty_buckets (bucket)
+                SELECT DISTINCT start_date::date FROM new_rows ON CONFLICT DO NOTHING;
+            END IF;
+        ELSIF TG_OP = 'INSERT' THEN
+            INSERT INTO network.rollup_dirty_buckets (bucket)
+            SELECT DISTINCT i.start_date::date FROM new_rows s JOIN network.incidents i ON i.id = s.incident_id
+            ON CONFLICT DO NOTHING;
+        ELSE
+            INSERT INTO network.rollup_dirty_buckets (bucket)
+            SELECT DISTINCT i.start_date::date FROM old_rows s JOIN network.incidents i ON i.id = s.incident_id
+            ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END $$
+""", """
+    DROP TRIGGER IF EXISTS rollup_incidents_insert ON network.incidents;
+    CREATE TRIGGER rollup_incidents_insert AFTER INSERT ON network.incidents
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION network.mark_rollup_buckets();
+    DROP TRIGGER IF EXISTS rollup_incidents_update ON network.incidents;
+    CREATE TRIGGER rollup_incidents_update AFTER UPDATE ON network.incidents
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION network.mark_rollup_buckets();
+    DROP TRIGGER IF EXISTS rollup_incidents_delete ON network.incidents;
+    CREATE TRIGGER rollup_incidents_delete AFTER DELETE ON network.incidents
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION network.mark_rollup_buckets();
+    DROP TRIGGER IF EXISTS rollup_services_insert ON network.affected_services;
+    CREATE TRIGGER rollup_services_insert AFTER INSERT ON network.affected_services
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION network.mark_rollup_buckets();
+    DROP TRIGGER IF EXISTS rollup_services_delete ON network.affected_services;
+    CREATE TRIGGER rollup_services_delete AFTER DELETE ON network.affected_services
+        REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION network.mark_rollup_buckets();
+""")]
+
 def create_database():
-    Session, engine = connect_database()
-    session = Session()
+    _, engine = connect_database()
     try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE SCHEMA IF NOT EXISTS network"))
+            if HISTORIC_PARTITIONED:
+                # Particionamento mensal por start_date; a PK precisa incluir a chave de partição
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS network.historic_incidents ("
+                    "id INTEGER NOT NULL, element VARCHAR NOT NULL, issue_type VARCHAR NOT NULL, "
+                    "start_date TIMESTAMP NOT NULL, end_date TIMESTAMP, time_range VARCHAR NOT NULL, "
+                    "type_service VARCHAR NOT NULL, PRIMARY KEY (id, start_date)"
+                    ") PARTITION BY RANGE (start_date)"
+                ))
+        with engine.connect() as conn:
+            new_rollups = conn.execute(text("SELECT to_regclass('network.incident_rollups') IS NULL")).scalar()
         Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            # create_all não adiciona colunas novas a tabelas que já existem
+            conn.execute(text(
+                "ALTER TABLE network.incidents ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1"
+            ))
+            conn.execute(FK_CASCADE_MIGRATION_SQL)
+            if conn.execute(text("SELECT to_regclass('network.uq_incident_natural_key') IS NULL")).scalar():
+                for statement in DEDUPLICATE_INCIDENTS_SQL:
+                    conn.execute(statement)
+            for statement in ROLLUP_TRIGGERS_SQL:
+                conn.execute(statement)
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS idx_incident_element_trgm "
+                    "ON network.incidents USING gin (element gin_trgm_ops)"
+                ))
+        except DBAPIError as e:
+            # Sem o pg_trgm a busca por elemento fica só com o prefixo
+            print(f"pg_trgm indisponível, busca por similaridade desativada: {str(e.orig).strip().splitlines()[0]}")
+        # create_all não adiciona índices novos a tabelas que já existem
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            for name in REDUNDANT_INDEXES:
+                conn.execute(text(f"DROP INDEX IF EXISTS network.{name}"))
+        if new_rollups:
+            # Dados anteriores aos triggers: o primeiro refresh calcula todo o histórico
+            refresh_incident_rollups(full=True)
         print("Tabelas criadas com sucesso no schema 'network'!")
     except Exception as e:
         print(f"Erro ao criar tabelas: {e}")
         raise
-    finally:
-        session.close()
-#create_database()
 
-def get_incidents_data():
-    Session, _ = connect_database()
-    session = Session()
+# Cache em memória (por processo) das consultas por service_id
+SERVICE_CACHE_SIZE = int(os.getenv("SERVICE_CACHE_SIZE", "10000"))
+SERVICE_CACHE_TTL = float(os.getenv("SERVICE_CACHE_TTL", "30"))
+SERVICE_CACHE_NEGATIVE_TTL = float(os.getenv("SERVICE_CACHE_NEGATIVE_TTL", "5"))
+
+class TTLCache:
+    def __init__(self, maxsize, ttl, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        # Retorna (encontrado, valor); None também é um valor válido (resultado negativo)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, generation=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            # Uma escrita invalidou o cache durante a consulta: o valor lido pode estar obsoleto
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "negative_ttl": self.negative_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+class ServiceCache(TTLCache):
+    # Com réplicas, a consulta que preenche o cache logo depois de uma invalidação pode ir para uma réplica
+    # atrasada e guardar a linha antiga pelo TTL inteiro. Cada invalidação registra a posição do WAL do
+    # primário; o preenchimento só lê de réplica que já reproduziu até ela (senão, do primário)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fill_lsn = 0
+        self._primary_only_until = 0
+
+    def invalidate(self, keys):
+        super().invalidate(keys)
+        self._record_fill_lsn()
+
+    def clear(self):
+        super().clear()
+        self._record_fill_lsn()
+
+    def _record_fill_lsn(self):
+        if not DB_REPLICA_URLS:
+            return
+        try:
+            with get_engine().connect() as conn:
+                lsn = parse_lsn(conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar())
+        except Exception:
+            # Sem a posição, o preenchimento fica no primário por um TTL
+            self._primary_only_until = time.monotonic() + self.ttl
+            return
+        with self._lock:
+            self.fill_lsn = max(self.fill_lsn, lsn)
+
+    def fill_engine(self):
+        if not self.fill_lsn and not self._primary_only_until:
+            return get_read_engine()
+        if time.monotonic() < self._primary_only_until:
+            return get_engine()
+        return _choose_read_engine(self.fill_lsn)
+
+service_cache = ServiceCache(SERVICE_CACHE_SIZE, SERVICE_CACHE_TTL, SERVICE_CACHE_NEGATIVE_TTL)
+
+INCIDENTS_MAX_PAGE_SIZE = int(os.getenv("INCIDENTS_MAX_PAGE_SIZE", "1000"))
+INCIDENTS_STREAM_BATCH = int(os.getenv("INCIDENTS_STREAM_BATCH", "1000"))
+
+# Leituras via SQLAlchemy Core: as linhas chegam como tuplas, sem objetos ORM nem identity map
+INCIDENT_COLUMNS = ("id", "element", "issue_type", "start_date", "end_date", "time_range", "type_service")
+
+# INCIDENTS_JSON_PASSTHROUGH=true: o Postgres monta o JSON de cada incidente e o app repassa os bytes
+INCIDENTS_JSON_PASSTHROUGH = env_flag("INCIDENTS_JSON_PASSTHROUGH", False)
+
+def _services_array(incidents, services):
+    # Agregação no banco: uma linha por incidente, com os service_ids num array
+    return (select(func.array_agg(aggregate_order_by(services.c.service_id, services.c.id)))
+            .where(services.c.incident_id == incidents.c.id)
+            .scalar_subquery())
+
+def _json_date(column):
+    # Mesmo formato de data do provedor JSON (http_date do Flask ou ISO)
+    if getattr(current_app.json, "datetime_format", None) == "iso":
+        return column
+    return func.to_char(column, 'Dy, DD Mon YYYY HH24:MI:SS "GMT"')
+
+def _incident_document(incidents, services):
+    # Chaves em ordem alfabética, como no jsonify
+    return cast(func.json_build_object(
+        "element", incidents.c.element,
+        "end_date", _json_date(incidents.c.end_date),
+        "id", incidents.c.id,
+        "issue_type", incidents.c.issue_type,
+        "services_affected", func.coalesce(_services_array(incidents, services), cast(literal([]), ARRAY(String))),
+        "start_date", _json_date(incidents.c.start_date),
+        "time_range", incidents.c.time_range,
+        "type_service", incidents.c.type_service
+    ), Text)
+
+# Filtros de igualdade aceitos pelas rotas de listagem
+INCIDENT_FILTER_FIELDS = ("element", "issue_type", "type_service")
+INCIDENT_FILTER_MAX_VALUES = int(os.getenv("INCIDENT_FILTER_MAX_VALUES", "100"))
+# Intervalo semiaberto [from, to) em start_date, servido por idx_incident_start_date
+INCIDENT_RANGE_FILTERS = {
+    "start_date_from": ("start_date", ">="),
+    "start_date_to": ("start_date", "<"),
+}
+# Ordenações aceitas: todas são NOT NULL e desempatam por id, o que mantém o keyset estável
+INCIDENT_SORT_FIELDS = ("id", "start_date", "element")
+DEFAULT_INCIDENT_SORT = ("id", False)
+INCIDENT_FIELDS = INCIDENT_COLUMNS + ("services_affected",)
+
+def _apply_incident_filters(stmt, incidents, filters):
+    for field, value in (filters or {}).items():
+        if field in INCIDENT_RANGE_FILTERS:
+            name, comparison = INCIDENT_RANGE_FILTERS[field]
+            stmt = stmt.where(incidents.c[name].op(comparison)(value))
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if len(values) == 1:
+            stmt = stmt.where(incidents.c[field] == values[0])
+        else:
+            stmt = stmt.where(incidents.c[field].in_(values))
+    return stmt
+
+def _apply_incident_sort(stmt, incidents, sort, after):
+    field, descending = sort or DEFAULT_INCIDENT_SORT
+    column, key = incidents.c[field], incidents.c.id
+    if after is not None:
+        if field == "id":
+            stmt = stmt.where(key < after if descending else key > after)
+        else:
+            # Comparação de linha (coluna, id): o Postgres a resolve com um range scan no índice composto
+            position = tuple_(column, key)
+            stmt = stmt.where(position < tuple_(*after) if descending else position > tuple_(*after))
+    if field == "id":
+        return stmt.order_by(key.desc() if descending else key)
+    return stmt.order_by(*((column.desc(), key.desc()) if descending else (column, key)))
+
+def _incidents_select(limit=None, after=None, active=False, historic=False, as_json=False, offset=None, filters=None,
+                      sort=None, fields=None):
+    # Incidentes arquivados mantêm o id original, então o mesmo keyset vale para as duas tabelas
+    incidents = (HistoricIncident if historic else Incident).__table__
+    services = (HistoricAffectedService if historic else AffectedService).__table__
+    if as_json:
+        stmt = select(incidents.c.id, _incident_document(incidents, services).label("document"))
+    else:
+        # Com fields= só as colunas pedidas (mais id e a chave de ordenação, usados no cursor) são lidas,
+        # e a subconsulta de serviços só roda quando services_affected foi pedido
+        sort_field = (sort or DEFAULT_INCIDENT_SORT)[0]
+        names = [name for name in INCIDENT_COLUMNS if not fields or name in fields or name in ("id", sort_field)]
+        columns = [incidents.c[name] for name in names]
+        if not fields or "services_affected" in fields:
+            columns.append(_services_array(incidents, services).label("services_affected"))
+        stmt = select(*columns)
+    if active:
+        # Mesmo predicado do índice parcial idx_incident_open
+        stmt = stmt.where(incidents.c.end_date.is_(None))
+    stmt = _apply_incident_filters(stmt, incidents, filters)
+    # Paginação por keyset direto em incidents: não há join multiplicando as linhas
+    return _apply_incident_sort(stmt, incidents, sort, after).limit(limit).offset(offset)
+
+def _incident_dict(row):
+    incident = row._asdict()
+    if "services_affected" in incident:
+        incident["services_affected"] = incident["services_affected"] or []
+    return incident
+
+def _incident_sort_key(sort):
+    field, _ = sort or DEFAULT_INCIDENT_SORT
+    return itemgetter("id") if field == "id" else itemgetter(field, "id")
+
+def _merge_historic(incidents, historic, sort):
+    return heapq.merge(incidents, historic, key=_incident_sort_key(sort), reverse=(sort or DEFAULT_INCIDENT_SORT)[1])
+
+def project_incident(incident, fields):
+    if not fields:
+        return incident
+    return {name: incident[name] for name in fields}
+
+def get_incidents_data(limit=None, after=None, active=False, include_historic=False, filters=None, sort=None,
+                       fields=None):
+    _, engine = connect_database(read_only=True)
     try:
-        # Fetch all incidents with their affected services
-        results = (session.query(Incident, AffectedService)
-                   .outerjoin(AffectedService, Incident.id == AffectedService.incident_id)
-                   .all())
-        
-        incidents = {}
-        for incident, affected_service in results:
-            incident_id = incident.id
-            if incident_id not in incidents:
-                incidents[incident_id] = {
-                    "id": incident_id,
-                    "element": incident.element,
-                    "issue_type": incident.issue_type,
-                    "start_date": incident.start_date,
-                    "end_date": incident.end_date,
-                    "time_range": incident.time_range,
-                    "type_service": incident.type_service,
-                    "services_affected": []
-                }
-            if affected_service and affected_service.service_id:
-                incidents[incident_id]["services_affected"].append(affected_service.service_id)
-        return list(incidents.values())
+        options = dict(limit=limit, after=after, filters=filters, sort=sort, fields=fields)
+        with engine.connect() as conn:
+            # Fetch incidents (optionally one keyset page) with their affected services
+            rows = conn.execute(_incidents_select(active=active, **options)).all()
+            data = [_incident_dict(row) for row in rows]
+            if include_historic and not active:
+                historic = conn.execute(_incidents_select(historic=True, **options)).all()
+                data = list(_merge_historic(data, map(_incident_dict, historic), sort))[:limit]
+        return data
     except Exception as e:
         raise Exception(str(e))
-    finally:
-        session.close()
+
+def stream_incidents_data(limit=None, after=None, include_historic=False, active=False, offset=None, filters=None,
+                          sort=None, fields=None):
+    _, engine = connect_database(read_only=True)
+    options = dict(limit=limit, after=after, offset=offset, filters=filters, sort=sort, fields=fields)
+    with engine.connect() as conn:
+        # yield_per usa um cursor no servidor: a memória não cresce com o tamanho da tabela
+        conn = conn.execution_options(yield_per=INCIDENTS_STREAM_BATCH)
+        incidents = map(_incident_dict, conn.execute(_incidents_select(active=active, **options)))
+        if include_historic and not active:
+            historic = map(_incident_dict, conn.execute(_incidents_select(historic=True, **options)))
+            incidents = islice(_merge_historic(incidents, historic, sort), limit)
+        yield from incidents
+
+def stream_incidents_json(limit=None, after=None, include_historic=False, active=False, filters=None):
+    # Como stream_incidents_data, mas gera (id, documento JSON em texto) sem decodificar nada
+    _, engine = connect_database(read_only=True)
+    options = dict(limit=limit, after=after, filters=filters, as_json=True)
+    with engine.connect() as conn:
+        conn = conn.execution_options(yield_per=INCIDENTS_STREAM_BATCH)
+        documents = map(tuple, conn.execute(_incidents_select(active=active, **options)))
+        if include_historic and not active:
+            historic = map(tuple, conn.execute(_incidents_select(historic=True, **options)))
+            documents = islice(heapq.merge(documents, historic, key=itemgetter(0)), limit)
+        yield from documents
 
 def get_incident_by_service_id(service_id):
-    Session, _ = connect_database()
-    session = Session()
+    if DB_REPLICA_URLS and has_request_context() and _required_lsn():
+        # Leia-suas-escritas: o cache de outro worker pode não ter sido invalidado pela escrita
+        return _query_incident_by_service_id(service_id)
+    found, data = service_cache.get(service_id)
+    if found:
+        return data
+    generation = service_cache.generation()
+    data = _query_incident_by_service_id(service_id, service_cache.fill_engine())
+    service_cache.set(service_id, data, generation)
+    return data
+
+def _service_lookup_select():
+    incidents = Incident.__table__
+    services = AffectedService.__table__
+    return (select(*[incidents.c[name] for name in INCIDENT_COLUMNS[1:]], services.c.service_id)
+            .select_from(incidents.join(services, incidents.c.id == services.c.incident_id)))
+
+def _query_incident_by_service_id(service_id, engine=None):
+    if engine is None:
+        _, engine = connect_database(read_only=True)
     try:
-        result = (session.query(Incident, AffectedService)
-                  .join(AffectedService, Incident.id == AffectedService.incident_id)
-                  .filter(AffectedService.service_id == service_id)
-                  .first())
-        if result:
-            incident, affected_service = result
-            return {
-                "element": incident.element,
-                "issue_type": incident.issue_type,
-                "start_date": incident.start_date,
-                "end_date": incident.end_date,
-                "time_range": incident.time_range,
-                "type_service": incident.type_service,
-                "service_id": affected_service.service_id
-            }
-        return None
+        with engine.connect() as conn:
+            row = conn.execute(
+                _service_lookup_select()
+                .where(AffectedService.__table__.c.service_id == service_id)
+                .order_by(AffectedService.__table__.c.incident_id)
+                .limit(1)
+            ).first()
+        return _service_incident_dict(row) if row else None
     except Exception as e:
         raise Exception(str(e))
-    finally:
-        session.close()
+
+def _service_incident_dict(row):
+    return {
+        "element": row.element,
+        "issue_type": row.issue_type,
+        "start_date": row.start_date,
+        "end_date": row.end_date,
+        "time_range": row.time_range,
+        "type_service": row.type_service,
+        "service_id": row.service_id
+    }
+
+SERVICE_LOOKUP_MAX_IDS = int(os.getenv("SERVICE_LOOKUP_MAX_IDS", "100000"))
+SERVICE_LOOKUP_CHUNK = int(os.getenv("SERVICE_LOOKUP_CHUNK", "10000"))
+
+def get_incidents_by_service_ids(service_ids):
+    # Resolve vários service_ids com uma consulta "= ANY(:ids)" por bloco. O cache é apenas
+    # consultado: gravar lotes grandes nele expulsaria as entradas quentes das consultas unitárias
+    results = {}
+    pending = []
+    for service_id in dict.fromkeys(service_ids):
+        found, data = service_cache.get(service_id)
+        if found:
+            results[service_id] = data
+        else:
+            pending.append(service_id)
+    if not pending:
+        return results
+
+    services = AffectedService.__table__
+    stmt = (_service_lookup_select()
+            .where(services.c.service_id == any_(bindparam("ids", type_=ARRAY(String))))
+            .distinct(services.c.service_id)
+            .order_by(services.c.service_id, services.c.incident_id))
+    _, engine = connect_database(read_only=True)
+    try:
+        with engine.connect() as conn:
+            for start in range(0, len(pending), SERVICE_LOOKUP_CHUNK):
+                chunk = pending[start:start + SERVICE_LOOKUP_CHUNK]
+                for row in conn.execute(stmt, {"ids": chunk}):
+                    results[row.service_id] = _service_incident_dict(row)
+    except Exception as e:
+        raise Exception(str(e))
+
+    for service_id in pending:
+        results.setdefault(service_id, None)
+    return results
+
+def _element_lookup_select(element_name):
+    incidents = Incident.__table__
+    first = (select(incidents.c.id)
+             .where(incidents.c.element == element_name)
+             .order_by(incidents.c.id)
+             .limit(1)
+             .scalar_subquery())
+    # O incidente e os seus serviços numa única consulta (sem lazy load)
+    return _incidents_select().where(incidents.c.id == first)
 
 def get_id_incident_by_element(element_name):
-    Session, _ = connect_database()
-    session = Session()
+    _, engine = connect_database(read_only=True)
     try:
-        incident = session.query(Incident).filter(Incident.element == element_name).first()
-        if not incident:
-            return None
-        
-        services = [service.service_id for service in incident.affected_services]
-        
-        result = {
-            "id": incident.id,
-            "element": incident.element,
-            "issue_type": incident.issue_type,
-            "start_date": incident.start_date,
-            "end_date": incident.end_date,
-            "time_range": incident.time_range,
-            "type_service": incident.type_service,
-            "services_affected": services
-        }
+        with engine.connect() as conn:
+            rows = conn.execute(_element_lookup_select(element_name)).all()
+        return _incident_dict(rows[0]) if rows else None
+    except Exception as e:
+        raise Exception(str(e))
+
+# Busca por elemento: prefixo (índice idx_incident_element_prefix) e, com o pg_trgm instalado, similaridade
+# por palavra (q <% element, índice GIN idx_incident_element_trgm). Exatos primeiro, depois prefixos, depois
+# os mais parecidos; ordenação e limite no banco
+ELEMENT_SEARCH_LIMIT = int(os.getenv("ELEMENT_SEARCH_LIMIT", "20"))
+ELEMENT_SEARCH_MAX_LIMIT = int(os.getenv("ELEMENT_SEARCH_MAX_LIMIT", "100"))
+ELEMENT_SEARCH_SIMILARITY = float(os.getenv("ELEMENT_SEARCH_SIMILARITY", "0.5"))
+ELEMENT_SEARCH_TRIGRAM_MIN_LENGTH = 3  # Abaixo disso quase não há trigramas em comum
+ELEMENT_SEARCH_MATCHES = ("exact", "prefix", "similar")
+
+_pg_trgm_available = None
+
+def _trigram_available(conn):
+    global _pg_trgm_available
+    if _pg_trgm_available is None:
+        _pg_trgm_available = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+        )).scalar()
+    return _pg_trgm_available
+
+def _element_search_select(query, limit, trigram=False):
+    incidents = Incident.__table__
+    element = incidents.c.element
+    prefix = func.lower(element).startswith(query.lower(), autoescape=True)
+    rank = case((element == query, 0), (prefix, 1), else_=2)
+    condition, order = prefix, [rank]
+    if trigram:
+        condition = or_(prefix, literal(query).op("<%")(element))
+        order.append(func.word_similarity(query, element).desc())
+    # Sem a subconsulta de serviços: eles vêm numa única consulta extra para todos os resultados
+    return (select(*[incidents.c[name] for name in INCIDENT_COLUMNS], rank.label("rank"))
+            .where(condition)
+            .order_by(*order, incidents.c.start_date.desc(), incidents.c.id.desc())
+            .limit(limit))
+
+def _services_by_incident(conn, incident_ids):
+    services = AffectedService.__table__
+    rows = conn.execute(
+        select(services.c.incident_id, func.array_agg(aggregate_order_by(services.c.service_id, services.c.id)))
+        .where(services.c.incident_id == any_(literal(list(incident_ids), ARRAY(Integer))))
+        .group_by(services.c.incident_id)
+    )
+    return dict(rows.all())
+
+def search_incidents_by_element(query, limit=ELEMENT_SEARCH_LIMIT):
+    _, engine = connect_database(read_only=True)
+    try:
+        with engine.begin() as conn:
+            trigram = len(query) >= ELEMENT_SEARCH_TRIGRAM_MIN_LENGTH and _trigram_available(conn)
+            if trigram:
+                conn.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                             {"threshold": str(ELEMENT_SEARCH_SIMILARITY)})
+            rows = conn.execute(_element_search_select(query, limit, trigram)).all()
+            services = _services_by_incident(conn, [row.id for row in rows]) if rows else {}
+        results = []
+        for row in rows:
+            incident = row._asdict()
+            incident["match"] = ELEMENT_SEARCH_MATCHES[incident.pop("rank")]
+            incident["services_affected"] = services.get(row.id, [])
+            results.append(incident)
+        return results
+    except Exception as e:
+        raise Exception(str(e))
+
+INCIDENTS_VERSION_SQL = text("""
+    INSERT INTO network.data_versions (name, version, updated_at)
+    VALUES ('incidents', 1, date_trunc('second', now() AT TIME ZONE 'UTC'))
+    ON CONFLICT (name) DO UPDATE
+    SET version = data_versions.version + 1, updated_at = EXCLUDED.updated_at
+    RETURNING version
+""")
+
+# Eventos de alteração publicados via NOTIFY: entregues a todos os workers e nós só após o commit
+INCIDENT_EVENTS_CHANNEL = os.getenv("INCIDENT_EVENTS_CHANNEL", "incident_events")
+INCIDENT_EVENTS_SQL = text(
+    "SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS TEXT[])) AS payload"
+)
+
+def _record_changes(conn, event_type, incident_ids):
+    # Na mesma transação da escrita: leitores só veem a nova versão depois do commit
+    version = conn.execute(INCIDENTS_VERSION_SQL).scalar()
+    payloads = [
+        json.dumps({"id": f"{version}-{seq}", "type": event_type, "incident_id": incident_id, "version": version})
+        for seq, incident_id in enumerate(incident_ids)
+    ]
+    if payloads:
+        conn.execute(INCIDENT_EVENTS_SQL, {"channel": INCIDENT_EVENTS_CHANNEL, "payloads": payloads})
+    if has_request_context():
+        g.wrote = True
+    return version
+
+# O cache por serviço é de cada processo: a invalidação local só alcança o worker que escreveu. Os demais
+# recebem as chaves por NOTIFY (entregue no commit) e o listener de cada processo as invalida. Uma lista
+# que não cabe no payload do NOTIFY (8000 bytes) vai vazia, e quem recebe limpa o cache inteiro
+SERVICE_CACHE_CHANNEL = os.getenv("SERVICE_CACHE_CHANNEL", "incident_service_cache")
+SERVICE_CACHE_NOTIFY_MAX_BYTES = 7900
+
+def _notify_service_invalidation(conn, service_ids):
+    keys = list(dict.fromkeys(map(str, service_ids)))
+    if not keys:
+        return
+    payload = json.dumps(keys)
+    if len(payload.encode()) > SERVICE_CACHE_NOTIFY_MAX_BYTES:
+        payload = ""
+    conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": SERVICE_CACHE_CHANNEL, "payload": payload})
+
+def get_data_version():
+    _, engine = connect_database(read_only=True)
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT version, updated_at FROM network.data_versions WHERE name = 'incidents'"
+        )).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+# time_range é sempre derivado das datas já convertidas pelo Postgres, no mesmo formato em toda escrita
+# (criação, upsert, bulk, PATCH, fechamento em lote), qualquer que seja o formato enviado pelo cliente
+TIME_RANGE_FORMAT = "YYYY-MM-DD HH24:MI"
+
+def time_range_expr(start, end):
+    return (func.to_char(start, TIME_RANGE_FORMAT) + " - "
+            + func.coalesce(func.to_char(end, TIME_RANGE_FORMAT), "ongoing"))
+
+def _time_range_sql(start, end):
+    # A mesma expressão, para as instruções em SQL textual
+    return (f"to_char({start}, '{TIME_RANGE_FORMAT}') || ' - ' || "
+            f"COALESCE(to_char({end}, '{TIME_RANGE_FORMAT}'), 'ongoing')")
+
+# Upsert pela chave natural numa única instrução. Um reenvio sem novidade não escreve nada (nem versão,
+# nem evento); um reenvio com data de fim ou serviços novos atualiza o incidente existente. O SELECT de
+# "target" cobre o caso sem escrita (o ON CONFLICT ... WHERE não devolve a linha)
+INCIDENT_UPSERT_SQL = text(f"""
+    WITH wanted AS (
+        SELECT service_id, position
+        FROM unnest(CAST(:service_ids AS VARCHAR[])) WITH ORDINALITY AS wanted(service_id, position)
+    ), upserted AS (
+        INSERT INTO network.incidents AS current (element, issue_type, start_date, end_date, time_range, type_service)
+        VALUES (:element, :issue_type, :start_date, :end_date,
+                {_time_range_sql("CAST(:start_date AS TIMESTAMP)", "CAST(:end_date AS TIMESTAMP)")}, :type_service)
+        ON CONFLICT (element, issue_type, start_date) DO UPDATE
+        SET end_date = COALESCE(EXCLUDED.end_date, current.end_date),
+            time_range = CASE WHEN EXCLUDED.end_date IS NULL THEN current.time_range ELSE EXCLUDED.time_range END,
+            version = current.version + 1
+        WHERE (EXCLUDED.end_date IS NOT NULL AND EXCLUDED.end_date IS DISTINCT FROM current.end_date)
+           OR EXISTS (
+                SELECT 1 FROM wanted WHERE NOT EXISTS (
+                    SELECT 1 FROM network.affected_services existing
+                    WHERE existing.incident_id = current.id AND existing.service_id = wanted.service_id
+                )
+           )
+        RETURNING id, xmax = 0 AS created
+    ), target AS (
+        SELECT id, created, true AS changed FROM upserted
+        UNION ALL
+        SELECT id, false, false FROM network.incidents
+        WHERE element = :element AND issue_type = :issue_type AND start_date = :start_date
+          AND NOT EXISTS (SELECT 1 FROM upserted)
+    ), added AS (
+        INSERT INTO network.affected_services (incident_id, service_id)
+        SELECT target.id, wanted.service_id FROM target, wanted
+        WHERE target.changed
+        ORDER BY wanted.position
+        ON CONFLICT (incident_id, service_id) DO NOTHING
+        RETURNING service_id
+    )
+    SELECT target.id, target.created, target.changed,
+           ARRAY(SELECT service_id FROM added) AS added,
+           ARRAY(SELECT service_id FROM network.affected_services WHERE incident_id = target.id) AS services
+    FROM target
+""")
+UPSERT_ATTEMPTS = 3
+
+def _upsert_incident(conn, element, issue_type, start_date, end_date, type_service, services_affected):
+    params = {
+        "element": element,
+        "issue_type": issue_type,
+        "start_date": start_date,
+        "end_date": end_date,
+        "type_service": type_service,
+        "service_ids": list(dict.fromkeys(map(str, services_affected or [])))
+    }
+    for _ in range(UPSERT_ATTEMPTS):
+        row = conn.execute(INCIDENT_UPSERT_SQL, params).first()
+        if row is not None:
+            break
+        # O conflito foi com um insert concorrente, confirmado depois do snapshot desta instrução
+    else:
+        raise Exception("Incident upsert did not converge")
+    result = {
+        "incident_id": row.id,
+        "created": row.created,
+        "updated": row.changed and not row.created,
+        "services_added": len(row.added)
+    }
+    # Serviços já existentes guardam os campos do incidente no cache: mudou o incidente, mudam todos
+    return result, (row.services + row.added) if row.changed else []
+
+def upsert_incident(element, issue_type, start_date, end_date, type_service, services_affected):
+    _, engine = connect_database()
+    try:
+        with engine.begin() as conn:
+            result, touched_services = _upsert_incident(
+                conn, element, issue_type, start_date, end_date, type_service, services_affected)
+            if result["created"] or result["updated"]:
+                _record_changes(conn, "created" if result["created"] else "updated", [result["incident_id"]])
+            _notify_service_invalidation(conn, touched_services)
+        service_cache.invalidate(touched_services)
         return result
     except Exception as e:
         raise Exception(str(e))
-    finally:
-        session.close()
 
 def insert_database(element, issue_type, start_date, end_date, type_service, services_affected):
+    return upsert_incident(element, issue_type, start_date, end_date, type_service, services_affected)["incident_id"]
+
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+BULK_REQUIRED_FIELDS = ["element", "issue_type", "start_date", "type_service", "services_affected"]
+
+def _validate_bulk_item(item):
+    if not isinstance(item, dict):
+        return "Item must be a JSON object"
+    missing = [field for field in BULK_REQUIRED_FIELDS if field not in item]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    if not isinstance(item["services_affected"], list):
+        return "services_affected must be a list"
+    return None
+
+def _bulk_incident_values(item):
+    return {
+        "element": item["element"],
+        "issue_type": item["issue_type"],
+        "start_date": item["start_date"],
+        "end_date": item.get("end_date"),
+        "type_service": item["type_service"],
+        "range_start": item["start_date"],
+        "range_end": item.get("end_date")
+    }
+
+# Itens cuja chave natural já existe no banco ou repete um item anterior do mesmo lote: só esses passam
+# pelo upsert item a item, o resto segue no INSERT multi-linha
+BULK_CONFLICTS_SQL = text("""
+    SELECT position - 1 AS position FROM (
+        SELECT input.*, row_number() OVER (
+            PARTITION BY element, issue_type, start_date ORDER BY position
+        ) AS occurrence
+        FROM unnest(CAST(:elements AS VARCHAR[]), CAST(:issue_types AS VARCHAR[]), CAST(:start_dates AS TIMESTAMP[]))
+            WITH ORDINALITY AS input(element, issue_type, start_date, position)
+    ) input
+    WHERE occurrence > 1 OR EXISTS (
+        SELECT 1 FROM network.incidents
+        WHERE incidents.element = input.element AND incidents.issue_type = input.issue_type
+          AND incidents.start_date = input.start_date
+    )
+    ORDER BY position
+""")
+
+def _bulk_conflicts(session, items):
+    return session.execute(BULK_CONFLICTS_SQL, {
+        "elements": [item["element"] for item in items],
+        "issue_types": [item["issue_type"] for item in items],
+        "start_dates": [item["start_date"] for item in items]
+    }).scalars().all()
+
+def _bulk_upsert_item(session, results, index, item):
+    try:
+        with session.begin_nested():
+            result, touched = _upsert_incident(
+                session, item["element"], item["issue_type"], item["start_date"], item.get("end_date"),
+                item["type_service"], item["services_affected"])
+        results[index] = {"index": index, "incident_id": result["incident_id"], "created": result["created"]}
+        if result["updated"]:
+            results[index]["updated"] = True
+        return touched
+    except DBAPIError as e:
+        results[index] = {"index": index, "error": str(e.orig).strip().splitlines()[0]}
+        return []
+
+def _bulk_insert_rows(session, items):
+    # INSERT multi-linha com RETURNING; sort_by_parameter_order garante ids na ordem dos itens
+    ids = session.execute(
+        insert(Incident)
+        .values(time_range=time_range_expr(cast(bindparam("range_start"), DateTime), cast(bindparam("range_end"), DateTime)))
+        .returning(Incident.id, sort_by_parameter_order=True),
+        [_bulk_incident_values(item) for item in items]
+    ).scalars().all()
+    services = [
+        {"incident_id": incident_id, "service_id": service_id}
+        for incident_id, item in zip(ids, items)
+        for service_id in item["services_affected"]
+    ]
+    if services:
+        session.execute(insert(AffectedService), services)
+    return ids
+
+# Insere vários incidentes numa única transação; retorna um resultado por item, na mesma ordem:
+# {"index", "incident_id", "created"} em caso de sucesso ou {"index", "error"} quando o item é rejeitado.
+# O INSERT multi-linha é o caminho rápido para os itens novos; os repetidos (chave natural) vão pelo upsert.
+# Se o lote é recusado (valor inválido, corrida com outro insert), refaz tudo item a item em savepoints
+def bulk_insert_database(items):
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        error = _validate_bulk_item(item)
+        if error:
+            results[index] = {"index": index, "error": error}
+        else:
+            valid.append(index)
+
     Session, _ = connect_database()
     session = Session()
+    touched_services = []
     try:
-        time_range = f"{start_date} - {end_date or 'ongoing'}"
-        incident = Incident(
-            element=element,
-            issue_type=issue_type,
-            start_date=start_date,
-            end_date=end_date,
-            time_range=time_range,
-            type_service=type_service
-        )
-        session.add(incident)
-        session.flush()  # Garante que o ID do incidente seja gerado
-        
-        for service_id in services_affected:
-            affected_service = AffectedService(incident_id=incident.id, service_id=service_id)
-            session.add(affected_service)
-        
+        try:
+            conflicts = [valid[position] for position in _bulk_conflicts(session, [items[index] for index in valid])]
+            repeated = set(conflicts)
+            fresh = [index for index in valid if index not in repeated]
+            ids = _bulk_insert_rows(session, [items[index] for index in fresh]) if fresh else []
+            for index, incident_id in zip(fresh, ids):
+                results[index] = {"index": index, "incident_id": incident_id, "created": True}
+                # Chaves do cache são as strings da URL, como o service_id gravado
+                touched_services += map(str, items[index]["services_affected"])
+            for index in conflicts:
+                touched_services += _bulk_upsert_item(session, results, index, items[index])
+        except DBAPIError:
+            session.rollback()
+            touched_services = []
+            for index in valid:
+                touched_services += _bulk_upsert_item(session, results, index, items[index])
+        created = [result["incident_id"] for result in results if result.get("created")]
+        updated = [result["incident_id"] for result in results if result.get("updated")]
+        if created:
+            _record_changes(session, "created", created)
+        if updated:
+            _record_changes(session, "updated", updated)
+        _notify_service_invalidation(session, touched_services)
         session.commit()
-        return incident.id
+        service_cache.invalidate(touched_services)
+        return results
     except Exception as e:
         session.rollback()
         raise Exception(str(e))
@@ -250,66 +1461,1290 @@ def insert_database(element, issue_type, start_date, end_date, type_service, ser
         session.close()
 
 def update_database(incident_id, element=None, issue_type=None, start_date=None, end_date=None, type_service=None, services_affected=None):
-    Session, _ = connect_database()
-    session = Session()
+    # Campos vazios continuam sendo ignorados nesta rota
+    fields = {name: value for name, value in (
+        ("element", element), ("issue_type", issue_type), ("start_date", start_date),
+        ("end_date", end_date), ("type_service", type_service)
+    ) if value}
+    return patch_incident(incident_id, fields, services_affected=services_affected) is not None
+
+PATCH_FIELDS = ("element", "issue_type", "start_date", "end_date", "type_service")
+
+# Diferenças de conjunto no próprio Postgres: só as linhas que mudam são inseridas ou removidas
+SERVICES_ADD_SQL = text("""
+    INSERT INTO network.affected_services (incident_id, service_id)
+    SELECT :incident_id, wanted.service_id
+    FROM unnest(CAST(:service_ids AS VARCHAR[])) WITH ORDINALITY AS wanted(service_id, position)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM network.affected_services existing
+        WHERE existing.incident_id = :incident_id AND existing.service_id = wanted.service_id
+    )
+    ORDER BY wanted.position
+    RETURNING service_id
+""")
+SERVICES_REMOVE_SQL = text("""
+    DELETE FROM network.affected_services
+    WHERE incident_id = :incident_id AND service_id = ANY(CAST(:service_ids AS VARCHAR[]))
+    RETURNING service_id
+""")
+SERVICES_KEEP_ONLY_SQL = text("""
+    DELETE FROM network.affected_services
+    WHERE incident_id = :incident_id AND service_id <> ALL(CAST(:service_ids AS VARCHAR[]))
+    RETURNING service_id
+""")
+
+def _time_range(incidents, fields):
+    start = cast(literal(fields["start_date"], String), DateTime) if "start_date" in fields else incidents.c.start_date
+    end = cast(literal(fields["end_date"], String), DateTime) if "end_date" in fields else incidents.c.end_date
+    return time_range_expr(start, end)
+
+def patch_incident(incident_id, fields=None, add_services=None, remove_services=None, services_affected=None,
+                   expected_versions=None):
+    _, engine = connect_database()
+    incidents = Incident.__table__
+    services = AffectedService.__table__
+    fields = fields or {}
     try:
-        incident = session.query(Incident).filter(Incident.id == incident_id).first()
-        if not incident:
-            return False
-        
-        if element:
-            incident.element = element
-        if issue_type:
-            incident.issue_type = issue_type
-        if start_date:
-            incident.start_date = start_date
-        if end_date:
-            incident.end_date = end_date
-        if type_service:
-            incident.type_service = type_service
-        if start_date or end_date:
-            incident.time_range = f"{start_date or incident.start_date} - {end_date or 'ongoing'}"
-        
-        if services_affected is not None:
-            session.query(AffectedService).filter(AffectedService.incident_id == incident_id).delete()
-            for service_id in services_affected:
-                session.add(AffectedService(incident_id=incident_id, service_id=service_id))
-        
-        session.commit()
-        return True
+        with engine.begin() as conn:
+            # Concorrência otimista: a versão esperada entra no WHERE, sem SELECT ... FOR UPDATE
+            values = dict(fields, version=incidents.c.version + 1)
+            if "start_date" in fields or "end_date" in fields:
+                values["time_range"] = _time_range(incidents, fields)
+            stmt = update(incidents).where(incidents.c.id == incident_id).values(**values).returning(incidents.c.version)
+            if expected_versions is not None:
+                stmt = stmt.where(incidents.c.version.in_(expected_versions))
+            version = conn.execute(stmt).scalar()
+            if version is None:
+                current = conn.execute(select(incidents.c.version).where(incidents.c.id == incident_id)).scalar()
+                return None if current is None else {"conflict": True, "version": current}
+
+            # O UPDATE acima segura o lock da linha até o commit: patches concorrentes do mesmo incidente
+            # esperam aqui em vez de intercalar as diferenças de serviços
+            params = {"incident_id": incident_id}
+            added, removed = [], []
+            if services_affected is not None:
+                wanted = list(dict.fromkeys(map(str, services_affected)))
+                removed = conn.execute(SERVICES_KEEP_ONLY_SQL, dict(params, service_ids=wanted)).scalars().all()
+                added = conn.execute(SERVICES_ADD_SQL, dict(params, service_ids=wanted)).scalars().all()
+            else:
+                if remove_services:
+                    removed = conn.execute(SERVICES_REMOVE_SQL, dict(
+                        params, service_ids=list(map(str, remove_services)))).scalars().all()
+                if add_services:
+                    added = conn.execute(SERVICES_ADD_SQL, dict(
+                        params, service_ids=list(dict.fromkeys(map(str, add_services))))).scalars().all()
+
+            touched_services = added + removed
+            if fields:
+                # O cache por serviço guarda os campos do incidente: todos os seus serviços ficam obsoletos
+                touched_services += conn.execute(
+                    select(services.c.service_id).where(services.c.incident_id == incident_id)
+                ).scalars().all()
+            _record_changes(conn, "updated", [incident_id])
+            _notify_service_invalidation(conn, touched_services)
+        service_cache.invalidate(touched_services)
+        return {
+            "incident_id": incident_id,
+            "version": version,
+            "services_added": len(added),
+            "services_removed": len(removed)
+        }
+    except Exception as e:
+        raise Exception(str(e))
+
+def get_incident_by_id(incident_id):
+    _, engine = connect_database(read_only=True)
+    incidents = Incident.__table__
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(
+                _incidents_select().add_columns(incidents.c.version).where(incidents.c.id == incident_id)
+            ).first()
+        return _incident_dict(row) if row else None
     except Exception as e:
-        session.rollback()
         raise Exception(str(e))
-    finally:
-        session.close()
 
 def delete_incident(incident_id):
-    Session, _ = connect_database()
-    session = Session()
+    return delete_incidents(ids=[incident_id])["deleted"] > 0
+
+def _incident_match(stmt, incidents, ids=None, filters=None):
+    if ids is not None:
+        stmt = stmt.where(incidents.c.id == any_(literal(list(ids), ARRAY(Integer))))
+    return _apply_incident_filters(stmt, incidents, filters)
+
+def delete_incidents(ids=None, filters=None):
+    # Um único DELETE com CTE: incidentes e serviços saem juntos e os ids voltam para eventos e cache.
+    # O ON DELETE CASCADE garante o mesmo resultado para quem apaga incidentes por outros caminhos
+    _, engine = connect_database()
+    incidents = Incident.__table__
+    services = AffectedService.__table__
+    deleted = _incident_match(delete(incidents), incidents, ids, filters).returning(incidents.c.id).cte("deleted")
+    deleted_services = (delete(services)
+                        .where(services.c.incident_id.in_(select(deleted.c.id)))
+                        .returning(services.c.service_id)
+                        .cte("deleted_services"))
+    stmt = select(
+        select(func.array_agg(aggregate_order_by(deleted.c.id, deleted.c.id))).scalar_subquery(),
+        select(func.array_agg(deleted_services.c.service_id)).scalar_subquery()
+    )
     try:
-        incident = session.query(Incident).filter(Incident.id == incident_id).first()
-        if not incident:
-            return False
-        
-        session.delete(incident)  # Cascade delete removerá os affected_services
-        session.commit()
-        return True
+        with engine.begin() as conn:
+            incident_ids, service_ids = conn.execute(stmt).one()
+            incident_ids, service_ids = incident_ids or [], service_ids or []
+            if incident_ids:
+                _record_changes(conn, "deleted", incident_ids)
+            _notify_service_invalidation(conn, service_ids)
+        service_cache.invalidate(service_ids)
+        return {"deleted": len(incident_ids), "services_deleted": len(service_ids)}
+    except Exception as e:
+        raise Exception(str(e))
+
+def close_incidents(ids=None, filters=None, end_date=None):
+    # Só incidentes em andamento são encerrados: repetir a chamada não altera os já fechados
+    _, engine = connect_database()
+    incidents = Incident.__table__
+    services = AffectedService.__table__
+    end_date = end_date or datetime.now().replace(second=0, microsecond=0)
+    end = cast(literal(str(end_date), String), DateTime)
+    closed = (_incident_match(update(incidents), incidents, ids, filters)
+              .where(incidents.c.end_date.is_(None))
+              .values(end_date=end,
+                      time_range=time_range_expr(incidents.c.start_date, end),
+                      version=incidents.c.version + 1)
+              .returning(incidents.c.id)
+              .cte("closed"))
+    stmt = select(
+        select(func.array_agg(aggregate_order_by(closed.c.id, closed.c.id))).scalar_subquery(),
+        select(func.array_agg(services.c.service_id))
+        .where(services.c.incident_id.in_(select(closed.c.id)))
+        .scalar_subquery()
+    )
+    try:
+        with engine.begin() as conn:
+            incident_ids, service_ids = conn.execute(stmt).one()
+            incident_ids, service_ids = incident_ids or [], service_ids or []
+            if incident_ids:
+                _record_changes(conn, "updated", incident_ids)
+            _notify_service_invalidation(conn, service_ids)
+        service_cache.invalidate(service_ids)
+        return {"closed": len(incident_ids)}
     except Exception as e:
-        session.rollback()
         raise Exception(str(e))
+
+# Arquivamento: move incidentes encerrados há mais de ARCHIVE_AFTER_DAYS para as tabelas históricas.
+# Cada lote é uma transação curta (DELETE ... RETURNING + INSERT ... SELECT numa única instrução).
+ARCHIVE_LOCK_ID = 7_340_001
+ARCHIVE_CANDIDATES_SQL = """
+    FROM network.incidents
+    WHERE end_date IS NOT NULL AND end_date < :cutoff
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+"""
+ARCHIVE_MOVE_SQL = """
+    WITH moved AS (
+        DELETE FROM network.incidents
+        WHERE id IN ({candidates})
+        RETURNING id, element, issue_type, start_date, end_date, time_range, type_service
+    ), moved_services AS (
+        DELETE FROM network.affected_services
+        WHERE incident_id IN (SELECT id FROM moved)
+        RETURNING id, incident_id, service_id
+    ), archived AS (
+        INSERT INTO network.historic_incidents (id, element, issue_type, start_date, end_date, time_range, type_service)
+        SELECT id, element, issue_type, start_date, end_date, time_range, type_service FROM moved
+    ), archived_services AS (
+        INSERT INTO network.historic_affected_services (id, incident_id, service_id)
+        SELECT id, incident_id, service_id FROM moved_services
+    )
+    SELECT (SELECT array_agg(id ORDER BY id) FROM moved), (SELECT array_agg(service_id) FROM moved_services)
+"""
+ARCHIVE_BATCH_SQL = text(ARCHIVE_MOVE_SQL.format(candidates=f"SELECT id {ARCHIVE_CANDIDATES_SQL}"))
+# Com particionamento os candidatos já foram travados na mesma transação: move exatamente esses ids
+ARCHIVE_IDS_BATCH_SQL = text(ARCHIVE_MOVE_SQL.format(candidates="SELECT unnest(CAST(:ids AS INTEGER[]))"))
+
+def _ensure_historic_partitions(conn, cutoff, batch_size):
+    # Trava os candidatos do próximo lote (mesmo predicado SKIP LOCKED do lote) e cria as partições
+    # mensais de que eles precisam; devolve os ids travados para o lote mover exatamente esses
+    rows = conn.execute(text(
+        f"SELECT id, date_trunc('month', start_date) AS month {ARCHIVE_CANDIDATES_SQL}"
+    ), {"cutoff": cutoff, "batch_size": batch_size}).all()
+    for month in sorted({row.month for row in rows}):
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS network.historic_incidents_{month:%Y_%m} "
+            f"PARTITION OF network.historic_incidents "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month:%Y-%m-%d}')"
+        ))
+    return [row.id for row in rows]
+
+def archive_incidents(older_than_days=None, batch_size=None, max_batches=None):
+    older_than_days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    _, engine = connect_database()
+    archived = 0
+    batches = 0
+    with engine.connect() as conn:
+        # Um único arquivador por banco, mesmo com vários workers e nós
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_ID}).scalar():
+            conn.rollback()
+            return {"archived": 0, "batches": 0, "skipped": True}
+        conn.commit()
+        try:
+            while max_batches is None or batches < max_batches:
+                with conn.begin():
+                    if HISTORIC_PARTITIONED:
+                        ids = _ensure_historic_partitions(conn, cutoff, batch_size)
+                        batch = conn.execute(ARCHIVE_IDS_BATCH_SQL, {"ids": ids})
+                    else:
+                        batch = conn.execute(ARCHIVE_BATCH_SQL, {"cutoff": cutoff, "batch_size": batch_size})
+                    incident_ids, service_ids = batch.one()
+                    if incident_ids:
+                        _record_changes(conn, "archived", incident_ids)
+                    _notify_service_invalidation(conn, service_ids or [])
+                if not incident_ids:
+                    break
+                service_cache.invalidate(service_ids or [])
+                archived += len(incident_ids)
+                batches += 1
+                time.sleep(ARCHIVE_BATCH_PAUSE)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_ID})
+            conn.commit()
+    return {"archived": archived, "batches": batches, "skipped": False}
+
+_archiver_thread = None
+_archiver_lock = threading.Lock()
+
+def _archiver_loop():
+    while True:
+        time.sleep(ARCHIVE_INTERVAL)
+        try:
+            result = archive_incidents()
+            if result["archived"]:
+                logger.info("Arquivados %s incidentes em %s lotes", result["archived"], result["batches"])
+        except Exception:
+            logger.exception("Erro ao arquivar incidentes")
+
+def start_archiver():
+    # Iniciado no processo que atende as requisições (threads não sobrevivem ao fork)
+    global _archiver_thread
+    with _archiver_lock:
+        if _archiver_thread is None or not _archiver_thread.is_alive():
+            _archiver_thread = threading.Thread(target=_archiver_loop, name="incident-archiver", daemon=True)
+            _archiver_thread.start()
+
+# Estatísticas: contagens, MTTR e percentis lidos dos rollups diários, nunca das tabelas de incidentes
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", "30"))  # 0: sem refresh em background
+# Refresh antes de cada leitura: números sempre atuais, mas cada leitura paga o recálculo dos dias marcados
+STATS_REFRESH_ON_READ = env_flag("STATS_REFRESH_ON_READ", False)
+STATS_TOP_LIMIT = int(os.getenv("STATS_TOP_LIMIT", "10"))
+# Limites (em segundos) das faixas do histograma de duração: 1 min ... 7 dias, mais a faixa aberta
+STATS_DURATION_BOUNDS = (60, 300, 900, 1800, 3600, 7200, 14400, 28800, 43200, 86400, 172800, 604800)
+STATS_PERCENTILES = (50, 90, 95, 99)
+STATS_INTERVALS = ("day", "week", "month")
+STATS_GROUPS = ("element", "issue_type", "type_service", "service_id")
+ROLLUP_LOCK_ID = 7_340_002
+
+def _rollup_sources(with_services=False):
+    # Incidentes ativos e arquivados: o arquivamento não muda as estatísticas
+    pairs = ((Incident.__table__, AffectedService.__table__),
+             (HistoricIncident.__table__, HistoricAffectedService.__table__))
+    if with_services:
+        parts = [select(incidents.c.start_date, incidents.c.end_date, services.c.service_id)
+                 .select_from(incidents.join(services, services.c.incident_id == incidents.c.id))
+                 for incidents, services in pairs]
+    else:
+        parts = [select(incidents.c.start_date, incidents.c.end_date, incidents.c.element,
+                        incidents.c.issue_type, incidents.c.type_service)
+                 for incidents, _ in pairs]
+    return union_all(*parts).subquery("source")
+
+def _rollup_select(source, dimensions, buckets):
+    duration = func.greatest(func.extract("epoch", source.c.end_date - source.c.start_date), 0)
+    band = func.width_bucket(duration, cast(literal(list(STATS_DURATION_BOUNDS)), ARRAY(Float)))
+    bucket = cast(source.c.start_date, Date)
+    stmt = select(
+        bucket,
+        *[source.c[name] for name in dimensions],
+        func.count(),
+        func.count(source.c.end_date),
+        func.coalesce(func.sum(duration), 0),
+        pg_array([func.count().filter(band == index) for index in range(len(STATS_DURATION_BOUNDS) + 1)])
+    ).group_by(bucket, *[source.c[name] for name in dimensions])
+    if buckets is not None:
+        # Intervalo em start_date (usa o índice) e só os dias marcados dentro dele
+        stmt = stmt.where(source.c.start_date >= min(buckets),
+                          source.c.start_date < max(buckets) + timedelta(days=1),
+                          bucket == any_(literal(list(buckets), ARRAY(Date))))
+    return stmt
+
+# Os dias marcados passam de rollup_dirty_buckets para rollup_claimed_buckets numa transação curta: se a
+# remoção ficasse na transação do recálculo, toda escrita concorrente no mesmo dia (o INSERT ... ON CONFLICT
+# do trigger) esperaria o recálculo inteiro. Escrita que chega depois marca o dia de novo; um refresh que
+# falha deixa os seus dias em rollup_claimed_buckets e o próximo os recalcula
+CLAIM_ROLLUP_BUCKETS_SQL = text("""
+    WITH claimed AS (DELETE FROM network.rollup_dirty_buckets RETURNING bucket)
+    INSERT INTO network.rollup_claimed_buckets (bucket) SELECT bucket FROM claimed ON CONFLICT DO NOTHING
+""")
+
+def refresh_incident_rollups(full=False):
+    _, engine = connect_database()
+    rollups = (
+        (IncidentRollup.__table__, ("element", "issue_type", "type_service"), False),
+        (ServiceRollup.__table__, ("service_id",), True),
+    )
+    claimed = RollupClaimedBucket.__table__
+    with engine.connect() as conn:
+        # Um refresh por vez (lock de sessão, vale para as duas transações); quem não obtém usa os rollups como estão
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ROLLUP_LOCK_ID}).scalar()
+        conn.commit()
+        if not locked:
+            return {"buckets": 0, "skipped": True}
+        try:
+            with conn.begin():
+                conn.execute(CLAIM_ROLLUP_BUCKETS_SQL)
+            with conn.begin():
+                buckets = conn.execute(select(claimed.c.bucket)).scalars().all()
+                if full:
+                    buckets = None
+                elif not buckets:
+                    return {"buckets": 0, "skipped": False}
+                for table, dimensions, with_services in rollups:
+                    stale = delete(table)
+                    if buckets is not None:
+                        stale = stale.where(table.c.bucket == any_(literal(buckets, ARRAY(Date))))
+                    conn.execute(stale)
+                    columns = ["bucket", *dimensions, "incidents", "closed", "duration_seconds", "duration_histogram"]
+                    conn.execute(insert(table).from_select(
+                        columns, _rollup_select(_rollup_sources(with_services), dimensions, buckets)))
+                conn.execute(delete(claimed))
+        finally:
+            # Conexão perdida: o lock de sessão foi junto com ela
+            if not conn.invalidated:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ROLLUP_LOCK_ID})
+                conn.commit()
+    return {"buckets": len(buckets) if buckets is not None else "all", "skipped": False}
+
+def _rollup_table(filters):
+    return ServiceRollup.__table__ if "service_id" in filters else IncidentRollup.__table__
+
+def _rollup_where(stmt, table, filters):
+    for field, values in filters.items():
+        if field == "start_date_from":
+            stmt = stmt.where(table.c.bucket >= values.date())
+        elif field == "start_date_to":
+            stmt = stmt.where(table.c.bucket < values.date())
+        else:
+            stmt = stmt.where(table.c[field].in_(values))
+    return stmt
+
+def _mttr(closed, duration_seconds):
+    return round(duration_seconds / closed, 1) if closed else None
+
+def _percentiles(histogram):
+    # Interpolação linear dentro da faixa; na faixa aberta (> 7 dias) devolve o limite inferior
+    total = sum(histogram)
+    if not total:
+        return {f"p{pct}": None for pct in STATS_PERCENTILES}
+    bounds = (0,) + STATS_DURATION_BOUNDS
+    result = {}
+    for pct in STATS_PERCENTILES:
+        rank = pct / 100 * total
+        seen = 0
+        for index, count in enumerate(histogram):
+            if count and seen + count >= rank:
+                if index + 1 >= len(bounds):
+                    value = bounds[-1]
+                else:
+                    low, high = bounds[index], bounds[index + 1]
+                    value = low + (high - low) * (rank - seen) / count
+                result[f"p{pct}"] = round(value, 1)
+                break
+            seen += count
+    return result
+
+def _histogram_select(table, filters):
+    bands = func.unnest(table.c.duration_histogram).table_valued("closed", with_ordinality="band").render_derived()
+    stmt = (select(bands.c.band, func.sum(bands.c.closed))
+            .select_from(table).join(bands, true())
+            .group_by(bands.c.band).order_by(bands.c.band))
+    return _rollup_where(stmt, table, filters)
+
+def _totals(table):
+    return (func.coalesce(func.sum(table.c.incidents), 0).label("incidents"),
+            func.coalesce(func.sum(table.c.closed), 0).label("closed"),
+            func.coalesce(func.sum(table.c.duration_seconds), 0).label("duration_seconds"))
+
+def _stats_row(row):
+    return {
+        "incidents": int(row.incidents),
+        "closed": int(row.closed),
+        "open": int(row.incidents - row.closed),
+        "mttr_seconds": _mttr(row.closed, row.duration_seconds),
+    }
+
+def _refresh_before_read():
+    if STATS_REFRESH_ON_READ:
+        refresh_incident_rollups()
+
+def get_incident_stats(filters, top=STATS_TOP_LIMIT):
+    _refresh_before_read()
+    _, engine = connect_database()
+    table = _rollup_table(filters)
+    try:
+        with engine.connect() as conn:
+            summary = _stats_row(conn.execute(_rollup_where(select(*_totals(table)), table, filters)).one())
+            histogram = [0] * (len(STATS_DURATION_BOUNDS) + 1)
+            for band, closed in conn.execute(_histogram_select(table, filters)):
+                histogram[band - 1] = int(closed)
+            summary["duration_percentiles_seconds"] = _percentiles(histogram)
+            summary["duration_histogram"] = [
+                {"le_seconds": bound, "closed": count}
+                for bound, count in zip(STATS_DURATION_BOUNDS + (None,), histogram)
+            ]
+            if table is IncidentRollup.__table__:
+                summary["top_elements"] = _top(conn, table, "element", filters, "incidents", top)
+        return summary
+    except Exception as e:
+        raise Exception(str(e))
+
+def get_incident_timeseries(filters, interval="day"):
+    _refresh_before_read()
+    _, engine = connect_database()
+    table = _rollup_table(filters)
+    bucket = table.c.bucket if interval == "day" else cast(func.date_trunc(interval, table.c.bucket), Date)
+    stmt = _rollup_where(select(bucket.label("bucket"), *_totals(table)), table, filters).group_by(bucket).order_by(bucket)
+    try:
+        with engine.connect() as conn:
+            return [dict(_stats_row(row), bucket=row.bucket.isoformat()) for row in conn.execute(stmt)]
+    except Exception as e:
+        raise Exception(str(e))
+
+def _top(conn, table, group, filters, order, limit):
+    incidents, closed, duration_seconds = _totals(table)
+    ranking = incidents if order == "incidents" else (duration_seconds / func.nullif(closed, 0)).label("mttr")
+    stmt = (_rollup_where(select(table.c[group], incidents, closed, duration_seconds), table, filters)
+            .group_by(table.c[group])
+            .order_by(ranking.desc().nulls_last(), table.c[group])
+            .limit(limit))
+    return [dict(_stats_row(row), **{group: row[0]}) for row in conn.execute(stmt)]
+
+def get_incident_top(group, filters, order="incidents", limit=STATS_TOP_LIMIT):
+    _refresh_before_read()
+    _, engine = connect_database()
+    table = ServiceRollup.__table__ if group == "service_id" else IncidentRollup.__table__
+    try:
+        with engine.connect() as conn:
+            return _top(conn, table, group, filters, order, limit)
+    except Exception as e:
+        raise Exception(str(e))
+
+_stats_thread = None
+_stats_lock = threading.Lock()
+
+def _stats_loop():
+    while True:
+        time.sleep(STATS_REFRESH_INTERVAL)
+        try:
+            refresh_incident_rollups()
+        except Exception:
+            logger.exception("Erro ao atualizar os rollups de estatísticas")
+
+def start_stats_refresher():
+    global _stats_thread
+    with _stats_lock:
+        if _stats_thread is None or not _stats_thread.is_alive():
+            _stats_thread = threading.Thread(target=_stats_loop, name="stats-refresher", daemon=True)
+            _stats_thread.start()
+
+# Feed de alterações: um listener (LISTEN) por processo distribui os eventos para os clientes SSE
+SSE_HISTORY_SIZE = int(os.getenv("SSE_HISTORY_SIZE", "10000"))
+SSE_CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", "1000"))
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "100"))
+# Cada cliente SSE ocupa uma thread do worker gthread pela conexão inteira: sob o `serve`, o limite por
+# worker vira WEB_THREADS - SSE_RESERVED_THREADS, para sobrar thread para as demais rotas. Para dezenas de
+# consumidores, aumente WEB_THREADS (clientes SSE não seguram conexão do pool)
+SSE_RESERVED_THREADS = int(os.getenv("SSE_RESERVED_THREADS", "2"))
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", "15"))
+
+def _event_key(event_id):
+    version, _, seq = str(event_id).partition("-")
+    return int(version), int(seq or 0)
+
+class IncidentEventHub:
+    def __init__(self, channel, history_size, max_clients):
+        self.channel = channel
+        self.history_size = history_size
+        self.max_clients = max_clients
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=self.history_size)
+        # Eventos anteriores a este ponto não estão no histórico deste processo
+        self._horizon = None
+        self._thread = None
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = queue.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+            self._subscribers.add(subscriber)
+            self._start()
+            return subscriber
+
+    def start(self):
+        # O listener também entrega as invalidações do cache de serviços: sobe em todo worker com cache
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            return
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._listen, name="incident-events", daemon=True)
+            self._thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def replay(self, last_event_id):
+        # Retorna (eventos posteriores a last_event_id, histórico completo?)
+        last = _event_key(last_event_id)
+        with self._lock:
+            complete = self._horizon is not None and last >= self._horizon
+            return [event for event in self._history if _event_key(event["id"]) > last], complete
+
+    def _dispatch(self, event):
+        with self._lock:
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Cliente lento: é desconectado e retoma pelo Last-Event-ID
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def _listen(self):
+        delay = 1
+        while True:
+            connection = None
+            try:
+                _, engine = connect_database()
+                # Conexão dedicada, fora do pool, em autocommit
+                connection = engine.raw_connection()
+                dbapi = connection.driver_connection
+                connection.detach()
+                dbapi.rollback()  # Encerra a transação aberta pelo pre-ping
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                    cursor.execute(f"LISTEN {SERVICE_CACHE_CHANNEL}")
+                    cursor.execute("SELECT version FROM network.data_versions WHERE name = 'incidents'")
+                    row = cursor.fetchone()
+                with self._lock:
+                    # Todos os eventos da versão lida (não só o primeiro) podem ter saído antes do LISTEN:
+                    # só quem já passou dessa versão tem o histórico completo
+                    self._horizon = (row[0] if row else 0, float("inf"))
+                    self._history.clear()
+                # Invalidações enviadas enquanto o listener estava fora foram perdidas
+                service_cache.clear()
+                delay = 1
+                while True:
+                    if select_module.select([dbapi], [], [], 60) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        notify = dbapi.notifies.pop(0)
+                        if notify.channel == SERVICE_CACHE_CHANNEL:
+                            if notify.payload:
+                                service_cache.invalidate(json.loads(notify.payload))
+                            else:
+                                service_cache.clear()
+                        else:
+                            self._dispatch(json.loads(notify.payload))
+            except Exception:
+                logger.exception("Listener de eventos desconectado; reconectando em %ss", delay)
+                with self._lock:
+                    self._horizon = None
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+event_hub = IncidentEventHub(INCIDENT_EVENTS_CHANNEL, SSE_HISTORY_SIZE, SSE_MAX_CLIENTS)
+
+if hasattr(os, "register_at_fork"):
+    # O thread do listener não existe no processo filho
+    os.register_at_fork(after_in_child=event_hub._reset)
+
+def _format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+# Verificação de índices: EXPLAIN das consultas da aplicação + estatísticas de uso
+def _index_check_queries():
+    return [
+        ("incidents", _incidents_select()),
+        ("incidents_page", _incidents_select(limit=100, after=0)),
+        ("incidents_active", _incidents_select(active=True)),
+        ("incidents_by_start_date", _incidents_select(
+            limit=100, sort=("start_date", True), filters={"start_date_from": datetime(2000, 1, 1)})),
+        ("incidents_by_issue_type", _incidents_select(
+            limit=100, filters={"issue_type": ["issue"], "start_date_from": datetime(2000, 1, 1)})),
+        ("incident_by_service_id", _service_lookup_select()
+            .where(AffectedService.__table__.c.service_id == "service")
+            .limit(1)),
+        ("incident_by_element", _element_lookup_select("element")),
+        ("incidents_by_element_prefix", _element_search_select("element", ELEMENT_SEARCH_LIMIT)),
+        ("services_by_incident", select(AffectedService.__table__).where(AffectedService.__table__.c.incident_id == 1)),
+    ]
+
+def _plan_scans(plan):
+    scans = []
+    if "Relation Name" in plan or "Index Name" in plan:
+        scans.append({
+            "node": plan["Node Type"],
+            "relation": plan.get("Relation Name"),
+            "index": plan.get("Index Name")
+        })
+    for child in plan.get("Plans", []):
+        scans.extend(_plan_scans(child))
+    return scans
+
+def check_indexes():
+    Session, engine = connect_database()
+    session = Session()
+    try:
+        report = {"queries": [], "missing_indexes": [], "unused_indexes": []}
+        for name, stmt in _index_check_queries():
+            sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+            # Com seqscan desligado, uma Seq Scan restante indica que nenhum índice atende a consulta
+            session.execute(text("SET LOCAL enable_seqscan = off"))
+            plan = session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()[0]["Plan"]
+            scans = _plan_scans(plan)
+            report["queries"].append({
+                "name": name,
+                "scans": scans,
+                "seq_scan": [scan["relation"] for scan in scans if scan["node"] == "Seq Scan"]
+            })
+            session.rollback()
+
+        existing = set(session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'network'"
+        )).scalars())
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    report["missing_indexes"].append({"table": table.name, "index": index.name})
+
+        rows = session.execute(text(
+            "SELECT s.relname, s.indexrelname, s.idx_scan "
+            "FROM pg_stat_user_indexes s JOIN pg_index i ON i.indexrelid = s.indexrelid "
+            "WHERE s.schemaname = 'network' AND NOT i.indisprimary AND s.idx_scan = 0"
+        ))
+        for table_name, index_name, scans in rows:
+            report["unused_indexes"].append({"table": table_name, "index": index_name, "scans": scans})
+        return report
     finally:
         session.close()
 
+# Exportação em massa via COPY ... TO STDOUT: o Postgres gera o CSV e os bytes seguem direto para a resposta
+# (ou arquivo), sem linhas nem dicts em Python. Parquet/Arrow são convertidos desse mesmo CSV pelo pyarrow,
+# em lotes. A memória fica limitada a EXPORT_QUEUE_CHUNKS pedaços de EXPORT_CHUNK_SIZE bytes
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(1 << 20)))
+EXPORT_QUEUE_CHUNKS = int(os.getenv("EXPORT_QUEUE_CHUNKS", "8"))
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+# Tabela exportada e, para os serviços, a tabela de incidentes que recebe o filtro de datas
+EXPORT_TABLES = {
+    "incidents": (Incident, None),
+    "affected_services": (AffectedService, Incident),
+    "historic_incidents": (HistoricIncident, None),
+    "historic_affected_services": (HistoricAffectedService, HistoricIncident),
+}
+
+class ExportCancelled(Exception):
+    pass
+
+def _export_select(table_name, start_date_from=None, start_date_to=None):
+    model, parent = EXPORT_TABLES[table_name]
+    table = model.__table__
+    incidents = (parent or model).__table__
+    conditions = []
+    if start_date_from:
+        conditions.append(incidents.c.start_date >= start_date_from)
+    if start_date_to:
+        conditions.append(incidents.c.start_date < start_date_to)
+    stmt = select(*table.c).order_by(table.c.id)
+    if conditions and parent is not None:
+        return stmt.where(table.c.incident_id.in_(select(incidents.c.id).where(*conditions)))
+    return stmt.where(*conditions)
+
+class _CopyBuffer:
+    # Destino do copy_expert: junta as linhas em pedaços e os entrega à fila (que limita a memória)
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= EXPORT_CHUNK_SIZE:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def put(self, item):
+        # Com a fila cheia espera o consumidor; se ele desistiu (cliente desconectou), aborta o COPY
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+class _CopyStream:
+    # O psycopg2 só faz COPY para um arquivo: uma thread escreve na fila e read() a esvazia. read() pode
+    # ser chamado de outra thread (o leitor de CSV do pyarrow lê na sua própria); close() destrava os dois
+    def __init__(self, engine, stmt):
+        self.raw = engine.raw_connection()
+        self.chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+        self.cancelled = threading.Event()
+        self.finished = False
+        try:
+            cursor = self.raw.cursor()
+            compiled = stmt.compile(dialect=engine.dialect)
+            sql = cursor.mogrify(str(compiled), compiled.params).decode()
+        except Exception:
+            self.raw.invalidate()
+            self.raw.close()
+            raise
+        self.producer = threading.Thread(target=self._produce, args=(cursor, sql), name="incidents-export", daemon=True)
+        self.producer.start()
+
+    def _produce(self, cursor, sql):
+        buffer = _CopyBuffer(self.chunks, self.cancelled)
+        try:
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+            if buffer.buffer:
+                buffer.put(bytes(buffer.buffer))
+            buffer.put(None)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            try:
+                buffer.put(e)
+            except ExportCancelled:
+                pass
+
+    def read(self):
+        # Próximo pedaço do CSV; b"" no fim
+        while not self.finished:
+            if self.cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                item = self.chunks.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                self.finished = True
+                break
+            if isinstance(item, Exception):
+                raise item
+            return item
+        return b""
+
+    def close(self):
+        if self.raw is None:
+            return
+        self.cancelled.set()
+        self.producer.join()
+        if self.finished:
+            self.raw.rollback()
+        else:
+            # COPY interrompido: a conexão não volta para o pool
+            self.raw.invalidate()
+        self.raw.close()
+        self.raw = None
+
+def copy_csv(engine, stmt):
+    copy = _CopyStream(engine, stmt)
+    try:
+        while True:
+            chunk = copy.read()
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        copy.close()
+
+# Opcional: exportação em Parquet/Arrow. Importado só na primeira exportação, para não pesar no cold start
+pyarrow = None
+
+def _load_pyarrow():
+    global pyarrow
+    if pyarrow is None:
+        try:
+            from pyarrow import csv, ipc, parquet  # noqa: F401
+        except ImportError:
+            return False
+        pyarrow = sys.modules["pyarrow"]
+    return True
+
+def _arrow_schema(table):
+    types = ((BigInteger, pyarrow.int64()), (Integer, pyarrow.int32()), (Float, pyarrow.float64()),
+             (DateTime, pyarrow.timestamp("us")), (Date, pyarrow.date32()), (String, pyarrow.string()))
+    return pyarrow.schema([
+        (column.name, next(arrow for sql_type, arrow in types if isinstance(column.type, sql_type)))
+        for column in table.c
+    ])
+
+class _ChunkReader(io.RawIOBase):
+    # Arquivo somente leitura sobre os pedaços do COPY, lido em blocos pelo leitor de CSV do pyarrow
+    def __init__(self, copy):
+        self.copy = copy
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            self.pending = self.copy.read()
+            if not self.pending:
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+class _ChunkSink(io.RawIOBase):
+    # Destino dos writers do pyarrow: acumula o que foi escrito até o próximo drain()
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def arrow_chunks(engine, stmt, table, export_format):
+    # Um lote (e um row group, no Parquet) por bloco de CSV: nada além de um bloco fica em memória
+    schema = _arrow_schema(table)
+    copy = _CopyStream(engine, stmt)
+    try:
+        yield from _arrow_batches(copy, schema, export_format)
+    finally:
+        copy.close()
+
+def _arrow_batches(copy, schema, export_format):
+    reader = pyarrow.csv.open_csv(
+        _ChunkReader(copy),
+        read_options=pyarrow.csv.ReadOptions(block_size=EXPORT_CHUNK_SIZE),
+        # No CSV do COPY, NULL é o campo vazio sem aspas e a string vazia é ""
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=schema, null_values=[""], strings_can_be_null=True, quoted_strings_can_be_null=False
+        ),
+    )
+    sink = _ChunkSink()
+    if export_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for batch in reader:
+        writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+def export_table(table_name, export_format="csv", start_date_from=None, start_date_to=None):
+    _, engine = connect_database(read_only=True)
+    stmt = _export_select(table_name, start_date_from, start_date_to)
+    if export_format == "csv":
+        return copy_csv(engine, stmt)
+    if not _load_pyarrow():
+        raise RuntimeError(f"Exportação em {export_format} requer o pacote pyarrow")
+    return arrow_chunks(engine, stmt, EXPORT_TABLES[table_name][0].__table__, export_format)
+
+# Compressão negociada das respostas (também incremental, para respostas em streaming)
+COMPRESSION_ENABLED = env_flag("COMPRESSION_ENABLED", True)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "6"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# Respostas em streaming: flush no máximo a cada intervalo (0 = a cada pedaço) ou volume de entrada
+COMPRESSION_STREAM_FLUSH_INTERVAL = float(os.getenv("COMPRESSION_STREAM_FLUSH_INTERVAL", "0.05"))
+COMPRESSION_STREAM_FLUSH_BYTES = int(os.getenv("COMPRESSION_STREAM_FLUSH_BYTES", str(64 * 1024)))
+COMPRESSION_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/csv", "text/plain"}
+
+# Cada fábrica devolve (compress, flush, finish); flush entrega o que já foi comprimido sem encerrar o fluxo
+def _gzip_compressor():
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+def _zstd_compressor():
+    compressor = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+    return compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+
+def _brotli_compressor():
+    compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+    return compressor.process, compressor.flush, compressor.finish
+
+# Ordem de preferência do servidor quando o cliente aceita várias codificações com o mesmo peso
+COMPRESSORS = {"gzip": _gzip_compressor}
+if brotli is not None:
+    COMPRESSORS = {"br": _brotli_compressor, **COMPRESSORS}
+if zstandard is not None:
+    COMPRESSORS = {"zstd": _zstd_compressor, **COMPRESSORS}
+COMPRESSORS = {
+    encoding: factory for encoding, factory in COMPRESSORS.items()
+    if encoding in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+}
+
+def _negotiate_encoding():
+    best, best_quality = None, 0
+    for encoding in COMPRESSORS:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def _compress_stream(chunks, compress, flush, finish):
+    # Os compressores seguram a saída até o fim: sem flush, um fluxo comprimido só chegaria inteiro no final.
+    # O primeiro pedaço sai na hora (tempo até o primeiro byte); depois, um flush por intervalo ou volume, já
+    # que um flush por linha de NDJSON quase dobra o tamanho comprimido
+    pending, last_flush = 0, None
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compress(chunk)
+            pending += len(chunk)
+            now = time.monotonic()
+            if (last_flush is None or pending >= COMPRESSION_STREAM_FLUSH_BYTES
+                    or now - last_flush >= COMPRESSION_STREAM_FLUSH_INTERVAL):
+                data += flush()
+                pending, last_flush = 0, now
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+@api.after_app_request
+def compress_response(response):
+    if (not COMPRESSION_ENABLED
+            or request.method == "HEAD"
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSION_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = _negotiate_encoding()
+    if encoding is None:
+        return response
+
+    compress, flush, finish = COMPRESSORS[encoding]()
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, compress, flush, finish)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return response
+        response.set_data(compress(data) + finish())
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        # Representações comprimidas são outros bytes: precisam de outro ETag forte
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+# GET condicional: ETag/Last-Modified derivados da versão dos dados, sem executar a consulta principal.
+# Cache-Control por rota: CACHE_CONTROL_<ENDPOINT> (ex.: CACHE_CONTROL_GET_INCIDENTS_HTML)
+CACHE_CONTROL_DEFAULT = os.getenv("CACHE_CONTROL_DEFAULT", "no-cache")
+
+def conditional_get(view):
+    cache_control = os.getenv(f"CACHE_CONTROL_{view.__name__.upper()}", CACHE_CONTROL_DEFAULT)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            version, updated_at = get_data_version()
+        except Exception:
+            return view(*args, **kwargs)
+        # A representação depende da URL, do formato negociado e do modo de serialização
+        variant = "|".join([
+            request.full_path,
+            request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) or "",
+            type(current_app.json).__name__,
+            str(INCIDENTS_JSON_PASSTHROUGH)
+        ])
+        etag = f"{version}-{hashlib.sha1(variant.encode()).hexdigest()[:16]}"
+        updated_at = updated_at.replace(tzinfo=timezone.utc) if updated_at else None
+
+        # Só If-None-Match decide o 304: Last-Modified tem resolução de segundo e não distingue duas escritas
+        # no mesmo segundo, então If-Modified-Since é ignorado (o header segue apenas informativo)
+        not_modified = None
+        if request.if_none_match:
+            # A compressão acrescenta a codificação ao ETag ("<etag>-gzip")
+            for candidate in [etag] + [f"{etag}-{encoding}" for encoding in COMPRESSORS]:
+                if request.if_none_match.contains_weak(candidate):
+                    not_modified = candidate
+                    break
+
+        if not_modified:
+            response = current_app.response_class(status=304)
+            response.set_etag(not_modified)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code not in (200, 404):
+                return response
+            response.set_etag(etag)
+        if updated_at:
+            response.last_modified = updated_at
+        response.headers['Cache-Control'] = cache_control
+        response.vary.add('Accept')
+        return response
+    return wrapper
+
+# Métricas por requisição: o middleware WSGI mede até o fim do corpo, inclusive respostas em streaming
+class MetricsMiddleware:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        _request_metrics.active = True
+        _request_metrics.db_statements = 0
+        _request_metrics.db_seconds = 0.0
+        _request_metrics.serialize_seconds = 0.0
+        _request_metrics.serializing = False
+        environ["incidents.metrics_start"] = start = time.perf_counter()
+        status = []
+
+        def capture_status(status_line, headers, exc_info=None):
+            status[:] = [status_line.split(" ", 1)[0]]
+            return start_response(status_line, headers, exc_info)
+
+        def observe():
+            _request_metrics.active = False
+            method = environ.get("REQUEST_METHOD", "")
+            route = environ.get("incidents.route", "<unmatched>")
+            HTTP_REQUESTS.inc(method, route, status[0] if status else "500")
+            HTTP_LATENCY.observe(time.perf_counter() - start, method, route)
+            HTTP_DB_STATEMENTS.observe(_request_metrics.db_statements, route)
+            HTTP_DB_SECONDS.observe(_request_metrics.db_seconds, route)
+            HTTP_SERIALIZE_SECONDS.observe(_request_metrics.serialize_seconds, route)
+
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except Exception:
+            observe()
+            raise
+        return ClosingIterator(body, observe)
+
+def _timed_serialization(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # response() do provedor padrão chama dumps(): só a chamada externa é cronometrada
+        if not getattr(_request_metrics, "active", False) or _request_metrics.serializing:
+            return func(*args, **kwargs)
+        _request_metrics.serializing = True
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _request_metrics.serialize_seconds += time.perf_counter() - start
+            _request_metrics.serializing = False
+    return wrapper
+
+@api.before_app_request
+def _label_request_route():
+    # Rótulo pela regra da rota, não pela URL: /incidents/service/<service_id> é uma série só
+    request.environ["incidents.route"] = request.url_rule.rule if request.url_rule else "<unmatched>"
+
+@api.after_app_request
+def server_timing(response):
+    # Registrado depois de compress_response, portanto roda antes dele (after_request é LIFO).
+    # Em respostas em streaming só entra o que foi executado até aqui
+    if SERVER_TIMING and getattr(_request_metrics, "active", False):
+        total = time.perf_counter() - request.environ["incidents.metrics_start"]
+        db = _request_metrics.db_seconds
+        serialize = _request_metrics.serialize_seconds
+        response.headers["Server-Timing"] = ", ".join([
+            f'db;dur={db * 1000:.2f};desc="{_request_metrics.db_statements} statements"',
+            f"serialize;dur={serialize * 1000:.2f}",
+            f"app;dur={max(total - db - serialize, 0) * 1000:.2f}",
+            f"total;dur={total * 1000:.2f}",
+        ])
+    return response
+
+@api.after_app_request
+def read_your_writes(response):
+    # Depois do commit: a posição atual do WAL cobre a escrita desta requisição
+    if not DB_REPLICA_URLS or not g.get("wrote") or response.status_code >= 400:
+        return response
+    try:
+        with get_engine().connect() as conn:
+            lsn = conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+    except Exception:
+        return response
+    response.headers[READ_YOUR_WRITES_HEADER] = lsn
+    response.set_cookie(READ_YOUR_WRITES_COOKIE, lsn, max_age=READ_YOUR_WRITES_TTL, httponly=True, samesite="Lax")
+    return response
+
+def _pool_gauge(read):
+    return lambda: read(get_engine().pool)
+
+METRICS = [
+    HTTP_REQUESTS, HTTP_LATENCY, HTTP_DB_STATEMENTS, HTTP_DB_SECONDS, HTTP_SERIALIZE_SECONDS,
+    DB_STATEMENT_SECONDS, DB_SLOW_STATEMENTS, DB_READS,
+    DB_POOL_CHECKOUTS, DB_POOL_CONNECTS, DB_POOL_WAITS, DB_POOL_TIMEOUTS, DB_POOL_WAIT_SECONDS,
+    Gauge("db_pool_size", "Configured pool size", _pool_gauge(lambda pool: pool.size())),
+    Gauge("db_pool_checked_out", "Connections currently checked out", _pool_gauge(lambda pool: pool.checkedout())),
+    Gauge("db_pool_idle", "Idle connections in the pool", _pool_gauge(lambda pool: pool.checkedin())),
+    Gauge("db_pool_overflow", "Connections open beyond pool_size", _pool_gauge(lambda pool: max(pool.overflow(), 0))),
+]
+
+def render_metrics():
+    return "\n".join(chain.from_iterable(metric.render() for metric in METRICS)) + "\n"
+
+@api.before_app_request
+def _start_background_jobs():
+    if ARCHIVE_ENABLED and _archiver_thread is None:
+        start_archiver()
+    if STATS_REFRESH_INTERVAL and _stats_thread is None:
+        start_stats_refresher()
+    if service_cache.maxsize > 0:
+        event_hub.start()
+
 # Rotas da API 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def home():
     return render_template('home.html')
 
-@app.route('/incidents', methods=['GET'])
+@api.route('/incidents', methods=['GET'])
 @swag_from({
     'tags': ['Incidents'],
     'summary': 'Retrieve all incidents',
-    'description': 'Returns a list of all incidents with their affected services.',
+    'description': 'Returns a list of all incidents with their affected services. '
+                   'Filters, sorting and field projection are applied in a single SQL query. '
+                   'Use limit/after for keyset pagination (the next cursor is returned in the X-Next-After header) '
+                   'or send Accept: application/x-ndjson to stream one incident per line.',
+    'produces': ['application/json', 'application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Maximum number of incidents in the page'
+        },
+        {
+            'name': 'after',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Cursor from X-Next-After: an id, or "<value>,<id>" when sorting by another field'
+        },
+        {
+            'name': 'element',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Element name; comma-separated or repeated values match any of them'
+        },
+        {
+            'name': 'issue_type',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Issue type; comma-separated or repeated values match any of them'
+        },
+        {
+            'name': 'type_service',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Service type; comma-separated or repeated values match any of them'
+        },
+        {
+            'name': 'start_date_from',
+            'in': 'query',
+            'type': 'string',
+            'format': 'date-time',
+            'required': False,
+            'description': 'Only incidents that started at or after this ISO 8601 date'
+        },
+        {
+            'name': 'start_date_to',
+            'in': 'query',
+            'type': 'string',
+            'format': 'date-time',
+            'required': False,
+            'description': 'Only incidents that started before this ISO 8601 date'
+        },
+        {
+            'name': 'active',
+            'in': 'query',
+            'type': 'boolean',
+            'required': False,
+            'description': 'Only ongoing incidents (no end_date)'
+        },
+        {
+            'name': 'sort',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['id', '-id', 'start_date', '-start_date', 'element', '-element'],
+            'required': False,
+            'description': 'Sort field, prefixed with - for descending order (default id)'
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Comma-separated list of fields to return, e.g. id,element,start_date'
+        },
+        {
+            'name': 'include_historic',
+            'in': 'query',
+            'type': 'boolean',
+            'required': False,
+            'description': 'Also return archived incidents from historic_incidents'
+        }
+    ],
     'responses': {
         200: {
             'description': 'List of incidents',
@@ -330,24 +2765,441 @@ def home():
                 }
             }
         },
-        404: {
-            'description': 'No incidents found'
+        400: {
+            'description': 'Invalid pagination, filter, sort or fields parameters'
+        },
+        404: {
+            'description': 'No incidents found'
+        },
+        500: {
+            'description': 'Internal server error'
+        }
+    }
+})
+@conditional_get
+def get_incidents():
+    try:
+        query, error = _incident_query_args()
+        if error:
+            return error
+        limit, after, error = _pagination_args(query["sort"])
+        if error:
+            return error
+        include_historic = request.args.get('include_historic', '').lower() in ('1', 'true', 'yes')
+        options = dict(limit=limit, after=after, include_historic=include_historic,
+                       active=query["active"], filters=query["filters"])
+        fields = query["fields"]
+
+        best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+        if INCIDENTS_JSON_PASSTHROUGH and query["sort"] == DEFAULT_INCIDENT_SORT and not fields:
+            return _passthrough_response(best == 'application/x-ndjson', **options)
+        if best == 'application/x-ndjson':
+            def generate():
+                for incident in stream_incidents_data(sort=query["sort"], fields=fields, **options):
+                    yield current_app.json.dumps(project_incident(incident, fields)) + "\n"
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        data = get_incidents_data(sort=query["sort"], fields=fields, **options)
+        if not data:
+            return jsonify({"error": "No incidents found"}), 404
+        return _paginated_response(data, limit, query["sort"], fields), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _incident_query_args():
+    filters = {}
+    for field in INCIDENT_FILTER_FIELDS:
+        # ?issue_type=a,b e ?issue_type=a&issue_type=b viram o mesmo IN (...)
+        values = [value.strip() for raw in request.args.getlist(field) for value in raw.split(',') if value.strip()]
+        if len(values) > INCIDENT_FILTER_MAX_VALUES:
+            return None, (jsonify({"error": f"{field} accepts at most {INCIDENT_FILTER_MAX_VALUES} values"}), 400)
+        if values:
+            filters[field] = list(dict.fromkeys(values))
+    for name in INCIDENT_RANGE_FILTERS:
+        value = request.args.get(name)
+        if value:
+            try:
+                filters[name] = datetime.fromisoformat(value)
+            except ValueError:
+                return None, (jsonify({"error": f"{name} must be an ISO 8601 date"}), 400)
+
+    sort = request.args.get('sort', 'id')
+    field = sort.lstrip('-')
+    if field not in INCIDENT_SORT_FIELDS:
+        return None, (jsonify({"error": f"sort must be one of {', '.join(INCIDENT_SORT_FIELDS)} (prefix - for descending)"}), 400)
+
+    fields = tuple(dict.fromkeys(name.strip() for name in request.args.get('fields', '').split(',') if name.strip()))
+    unknown = [name for name in fields if name not in INCIDENT_FIELDS]
+    if unknown:
+        return None, (jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400)
+
+    return {
+        "filters": filters,
+        "active": request.args.get('active', '').lower() in ('1', 'true', 'yes'),
+        "sort": (field, sort.startswith('-')),
+        "fields": fields or None,
+    }, None
+
+def _pagination_args(sort=DEFAULT_INCIDENT_SORT):
+    limit = request.args.get('limit')
+    after = request.args.get('after')
+    try:
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        return None, None, (jsonify({"error": "limit must be an integer"}), 400)
+    if limit is not None and not 1 <= limit <= INCIDENTS_MAX_PAGE_SIZE:
+        return None, None, (jsonify({"error": f"limit must be between 1 and {INCIDENTS_MAX_PAGE_SIZE}"}), 400)
+    try:
+        after = _parse_cursor(after, sort) if after is not None else None
+    except ValueError:
+        return None, None, (jsonify({"error": "after is not a valid cursor for this sort"}), 400)
+    return limit, after, None
+
+def _parse_cursor(after, sort):
+    field, _ = sort
+    if field == "id":
+        return int(after)
+    # Cursor "<valor>,<id>": rsplit porque o valor (element) pode conter vírgulas
+    value, incident_id = after.rsplit(',', 1)
+    return (datetime.fromisoformat(value) if field == "start_date" else value), int(incident_id)
+
+def _cursor(incident, sort):
+    field, _ = sort
+    if field == "id":
+        return str(incident["id"])
+    value = incident[field]
+    return f"{value.isoformat() if isinstance(value, datetime) else value},{incident['id']}"
+
+def _paginated_response(data, limit, sort=DEFAULT_INCIDENT_SORT, fields=None):
+    response = jsonify([project_incident(incident, fields) for incident in data])
+    if data:
+        _set_next_cursor(response, limit, len(data), _cursor(data[-1], sort))
+    return response
+
+def _set_next_cursor(response, limit, count, cursor):
+    if limit is not None and count == limit:
+        # O link preserva filtros, ordenação e projeção da requisição atual
+        args = request.args.to_dict(flat=False)
+        args['after'] = [cursor]
+        response.headers['X-Next-After'] = cursor
+        response.headers['Link'] = f'<{request.path}?{urlencode(args, doseq=True)}>; rel="next"'
+
+def _passthrough_response(ndjson, limit, after, include_historic, active=False, filters=None):
+    # Os documentos já chegam serializados pelo Postgres: só são concatenados
+    documents = stream_incidents_json(limit=limit, after=after, include_historic=include_historic,
+                                      active=active, filters=filters)
+    if ndjson:
+        return Response(stream_with_context(document + "\n" for _, document in documents),
+                        mimetype='application/x-ndjson')
+    if limit is not None:
+        page = list(documents)
+        if not page:
+            return jsonify({"error": "No incidents found"}), 404
+        response = Response("[" + ",".join(document for _, document in page) + "]\n", mimetype='application/json')
+        _set_next_cursor(response, limit, len(page), str(page[-1][0]))
+        return response, 200
+
+    first = next(documents, None)
+    if first is None:
+        documents.close()
+        return jsonify({"error": "No incidents found"}), 404
+    def generate():
+        yield "[" + first[1]
+        for _, document in documents:
+            yield "," + document
+        yield "]\n"
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
+
+@api.route('/incidents/active', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'summary': 'Retrieve ongoing incidents',
+    'description': 'Returns the incidents without end_date, with their affected services. '
+                   'Supports the same limit/after keyset pagination as /incidents.',
+    'parameters': [
+        {
+            'name': 'limit',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Maximum number of incidents in the page'
+        },
+        {
+            'name': 'after',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Return only incidents with id greater than this cursor'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'List of ongoing incidents'
+        },
+        400: {
+            'description': 'Invalid pagination parameters'
+        },
+        404: {
+            'description': 'No ongoing incidents found'
+        },
+        500: {
+            'description': 'Internal server error'
+        }
+    }
+})
+@conditional_get
+def get_active_incidents():
+    try:
+        limit, after, error = _pagination_args()
+        if error:
+            return error
+        data = get_incidents_data(limit=limit, after=after, active=True)
+        if not data:
+            return jsonify({"error": "No ongoing incidents found"}), 404
+        return _paginated_response(data, limit), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _stats_filter_args():
+    query, error = _incident_query_args()
+    if error:
+        return None, error
+    filters = query["filters"]
+    service_ids = [value.strip() for raw in request.args.getlist('service_id') for value in raw.split(',') if value.strip()]
+    if service_ids:
+        # O rollup por serviço só tem a dimensão service_id
+        if any(field in filters for field in INCIDENT_FILTER_FIELDS):
+            return None, (jsonify({"error": "service_id cannot be combined with element, issue_type or type_service"}), 400)
+        filters["service_id"] = service_ids
+    return filters, None
+
+STATS_FILTER_PARAMETERS = [
+    {'name': 'element', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Element name; comma-separated values match any of them'},
+    {'name': 'issue_type', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Issue type; comma-separated values match any of them'},
+    {'name': 'type_service', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Service type; comma-separated values match any of them'},
+    {'name': 'service_id', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Affected service; cannot be combined with the incident filters'},
+    {'name': 'start_date_from', 'in': 'query', 'type': 'string', 'format': 'date', 'required': False,
+     'description': 'First day included (day granularity)'},
+    {'name': 'start_date_to', 'in': 'query', 'type': 'string', 'format': 'date', 'required': False,
+     'description': 'First day excluded (day granularity)'}
+]
+
+@api.route('/incidents/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Statistics'],
+    'summary': 'Incident statistics',
+    'description': 'Counts, mean time to repair and approximate duration percentiles (from a duration histogram) '
+                   'for the selected incidents, plus the top elements. Read from daily rollups, '
+                   'refreshed incrementally for the days that changed.',
+    'parameters': STATS_FILTER_PARAMETERS + [
+        {'name': 'top', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Number of top elements to return'}
+    ],
+    'responses': {
+        200: {'description': 'Statistics'},
+        400: {'description': 'Invalid filters'},
+        500: {'description': 'Internal server error'}
+    }
+})
+def get_stats():
+    try:
+        filters, error = _stats_filter_args()
+        if error:
+            return error
+        top = request.args.get('top', STATS_TOP_LIMIT, type=int)
+        if not 1 <= top <= INCIDENTS_MAX_PAGE_SIZE:
+            return jsonify({"error": f"top must be between 1 and {INCIDENTS_MAX_PAGE_SIZE}"}), 400
+        return jsonify(get_incident_stats(filters, top=top)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/stats/timeseries', methods=['GET'])
+@swag_from({
+    'tags': ['Statistics'],
+    'summary': 'Incident counts and MTTR per time bucket',
+    'parameters': STATS_FILTER_PARAMETERS + [
+        {'name': 'interval', 'in': 'query', 'type': 'string', 'enum': list(STATS_INTERVALS), 'required': False,
+         'description': 'Bucket size by start_date (default day)'}
+    ],
+    'responses': {
+        200: {'description': 'One entry per bucket with incidents, closed, open and mttr_seconds'},
+        400: {'description': 'Invalid filters or interval'},
+        500: {'description': 'Internal server error'}
+    }
+})
+def get_stats_timeseries():
+    try:
+        filters, error = _stats_filter_args()
+        if error:
+            return error
+        interval = request.args.get('interval', 'day')
+        if interval not in STATS_INTERVALS:
+            return jsonify({"error": f"interval must be one of {', '.join(STATS_INTERVALS)}"}), 400
+        return jsonify(get_incident_timeseries(filters, interval=interval)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/stats/top', methods=['GET'])
+@swag_from({
+    'tags': ['Statistics'],
+    'summary': 'Top elements, issue types, service types or services',
+    'parameters': STATS_FILTER_PARAMETERS + [
+        {'name': 'by', 'in': 'query', 'type': 'string', 'enum': list(STATS_GROUPS), 'required': False,
+         'description': 'Dimension to rank (default element)'},
+        {'name': 'order', 'in': 'query', 'type': 'string', 'enum': ['incidents', 'mttr'], 'required': False,
+         'description': 'Rank by incident count or by mean time to repair (default incidents)'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Number of entries'}
+    ],
+    'responses': {
+        200: {'description': 'Ranked entries with incidents, closed, open and mttr_seconds'},
+        400: {'description': 'Invalid parameters'},
+        500: {'description': 'Internal server error'}
+    }
+})
+def get_stats_top():
+    try:
+        filters, error = _stats_filter_args()
+        if error:
+            return error
+        group = request.args.get('by', 'element')
+        order = request.args.get('order', 'incidents')
+        limit = request.args.get('limit', STATS_TOP_LIMIT, type=int)
+        if group not in STATS_GROUPS:
+            return jsonify({"error": f"by must be one of {', '.join(STATS_GROUPS)}"}), 400
+        if order not in ("incidents", "mttr"):
+            return jsonify({"error": "order must be incidents or mttr"}), 400
+        if not 1 <= limit <= INCIDENTS_MAX_PAGE_SIZE:
+            return jsonify({"error": f"limit must be between 1 and {INCIDENTS_MAX_PAGE_SIZE}"}), 400
+        # Ranking por serviço vem de service_rollups, que não tem as dimensões do incidente (e vice-versa)
+        if group == "service_id" and any(field in filters for field in INCIDENT_FILTER_FIELDS):
+            return jsonify({"error": "by=service_id cannot be combined with element, issue_type or type_service"}), 400
+        if group != "service_id" and "service_id" in filters:
+            return jsonify({"error": "service_id can only be used with by=service_id"}), 400
+        return jsonify(get_incident_top(group, filters, order=order, limit=limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/export', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'summary': 'Bulk export of a table',
+    'description': 'Streams a whole table produced by Postgres COPY ... TO STDOUT, as CSV (with header), Parquet '
+                   'or an Arrow IPC stream. Parquet and Arrow require pyarrow on the server. The date range '
+                   'filters incidents by start_date; service tables follow the range of their incidents.',
+    'produces': ['text/csv', 'application/vnd.apache.parquet', 'application/vnd.apache.arrow.stream'],
+    'parameters': [
+        {'name': 'table', 'in': 'query', 'type': 'string', 'required': False, 'default': 'incidents',
+         'enum': list(EXPORT_TABLES)},
+        {'name': 'format', 'in': 'query', 'type': 'string', 'required': False, 'default': 'csv',
+         'enum': list(EXPORT_FORMATS)},
+        {'name': 'start_date_from', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': 'Only incidents starting at or after this ISO 8601 date'},
+        {'name': 'start_date_to', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': 'Only incidents starting before this ISO 8601 date'}
+    ],
+    'responses': {
+        200: {
+            'description': 'The exported rows, streamed'
+        },
+        400: {
+            'description': 'Unknown table or format, or invalid date'
+        },
+        501: {
+            'description': 'Parquet/Arrow requested but pyarrow is not installed'
         },
         500: {
             'description': 'Internal server error'
         }
     }
 })
-def get_incidents():
+def export_incidents():
+    table_name = request.args.get('table', 'incidents')
+    export_format = request.args.get('format', 'csv')
+    if table_name not in EXPORT_TABLES:
+        return jsonify({"error": f"table must be one of: {', '.join(EXPORT_TABLES)}"}), 400
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if export_format != "csv" and not _load_pyarrow():
+        return jsonify({"error": f"{export_format} export requires pyarrow on the server"}), 501
+    dates = {}
+    for name in INCIDENT_RANGE_FILTERS:
+        value = request.args.get(name)
+        if value:
+            try:
+                dates[name] = datetime.fromisoformat(value)
+            except ValueError:
+                return jsonify({"error": f"{name} must be an ISO 8601 date"}), 400
     try:
-        data = get_incidents_data()
-        if not data:
-            return jsonify({"error": "No incidents found"}), 404
-        return jsonify(data), 200
+        chunks = export_table(table_name, export_format, **dates)
+        # O primeiro pedaço é lido aqui: erros do COPY ainda viram uma resposta 500
+        first = next(chunks, b"")
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    return Response(stream_with_context(chain([first], chunks)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{table_name}.{extension}"'})
+
+@api.route('/incidents/stream', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'summary': 'Stream incident changes (Server-Sent Events)',
+    'description': 'Pushes created/updated/deleted/archived events as they are committed. '
+                   'Reconnecting clients send Last-Event-ID to resume; a "resync" event means the '
+                   'history was not available and the client should reload /incidents.',
+    'produces': ['text/event-stream'],
+    'responses': {
+        200: {
+            'description': 'Event stream'
+        },
+        503: {
+            'description': 'Too many stream clients on this worker'
+        }
+    }
+})
+def stream_incident_events():
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscriber = event_hub.subscribe()
+    if subscriber is None:
+        return jsonify({"error": "Too many stream clients"}), 503
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            last = None
+            if last_event_id:
+                try:
+                    events, complete = event_hub.replay(last_event_id)
+                except ValueError:
+                    events, complete = [], False
+                if not complete:
+                    yield "event: resync\ndata: {}\n\n"
+                for event in events:
+                    last = _event_key(event["id"])
+                    yield _format_sse(event)
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                # Eventos que já saíram no replay também podem estar na fila
+                if last is not None and _event_key(event["id"]) <= last:
+                    continue
+                yield _format_sse(event)
+        finally:
+            event_hub.unsubscribe(subscriber)
 
-@app.route('/incidents/service/<service_id>', methods=['GET'])
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/incidents/service/<service_id>', methods=['GET'])
 @swag_from({
     'tags': ['Services'],
     'summary': 'Get incident by service ID',
@@ -394,7 +3246,172 @@ def get_incident_service(service_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/incidents/element/<element_name>', methods=['GET'])
+@api.route('/incidents/services/lookup', methods=['POST'])
+@swag_from({
+    'tags': ['Services'],
+    'summary': 'Look up incidents for many service IDs',
+    'description': 'Resolves a list of service IDs in a single set-based query and returns a map '
+                   'from service_id to its incident (null when the service is not affected).',
+    'consumes': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'service_ids': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'example': ['svc1', 'svc2']
+                    }
+                },
+                'required': ['service_ids']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Map from service_id to incident',
+            'schema': {
+                'type': 'object',
+                'additionalProperties': {'type': 'object'}
+            }
+        },
+        400: {
+            'description': 'Invalid or missing data'
+        },
+        413: {
+            'description': 'Too many service IDs'
+        },
+        415: {
+            'description': 'Unsupported media type'
+        },
+        500: {
+            'description': 'Internal server error'
+        }
+    }
+})
+def lookup_incident_services():
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Invalid data"}), 415
+
+        data = request.get_json(silent=True)
+        service_ids = data.get("service_ids") if isinstance(data, dict) else data
+        if not isinstance(service_ids, list) or not service_ids:
+            return jsonify({"error": "service_ids must be a non-empty list"}), 400
+        if len(service_ids) > SERVICE_LOOKUP_MAX_IDS:
+            return jsonify({"error": f"At most {SERVICE_LOOKUP_MAX_IDS} service IDs per request"}), 413
+
+        service_ids = [str(service_id) for service_id in service_ids]
+        return jsonify(get_incidents_by_service_ids(service_ids)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/cache/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Services'],
+    'summary': 'Service lookup cache statistics',
+    'description': 'Returns the size and hit/miss/eviction counters of the in-process service ID cache (per worker).',
+    'responses': {
+        200: {
+            'description': 'Cache counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'size': {'type': 'integer'},
+                    'maxsize': {'type': 'integer'},
+                    'hits': {'type': 'integer'},
+                    'misses': {'type': 'integer'},
+                    'evictions': {'type': 'integer'},
+                    'expirations': {'type': 'integer'},
+                    'invalidations': {'type': 'integer'}
+                }
+            }
+        }
+    }
+})
+def get_cache_stats():
+    return jsonify({"service_cache": service_cache.stats()}), 200
+
+@api.route('/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Metrics'],
+    'summary': 'Prometheus metrics',
+    'description': 'Per-route request counts and latency histograms, SQL statement counts and time per request, '
+                   'and connection pool checkouts and waits, in Prometheus text format (per worker process).',
+    'produces': ['text/plain'],
+    'responses': {
+        200: {
+            'description': 'Metrics in Prometheus exposition format'
+        },
+        404: {
+            'description': 'Metrics are disabled (METRICS_ENABLED=false)'
+        }
+    }
+})
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4'), 200
+
+@api.route('/incidents/search/element', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'summary': 'Search incidents by element name',
+    'description': 'Case-insensitive prefix search on the element name, plus trigram similarity when the '
+                   'pg_trgm extension is installed. Exact matches come first, then prefix matches, then '
+                   'the most similar names; each result has "match" set to exact, prefix or similar.',
+    'parameters': [
+        {'name': 'q', 'in': 'query', 'type': 'string', 'required': True,
+         'description': 'Full or partial element name, e.g. rtr-sp'},
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Maximum number of incidents (default 20)'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Matching incidents, best matches first',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {'type': 'integer'},
+                        'element': {'type': 'string'},
+                        'issue_type': {'type': 'string'},
+                        'start_date': {'type': 'string'},
+                        'end_date': {'type': 'string'},
+                        'time_range': {'type': 'string'},
+                        'type_service': {'type': 'string'},
+                        'services_affected': {'type': 'array', 'items': {'type': 'string'}},
+                        'match': {'type': 'string', 'enum': list(ELEMENT_SEARCH_MATCHES)}
+                    }
+                }
+            }
+        },
+        400: {
+            'description': 'Missing q or invalid limit'
+        },
+        500: {
+            'description': 'Internal server error'
+        }
+    }
+})
+def search_incident_element():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    limit = request.args.get("limit", ELEMENT_SEARCH_LIMIT, type=int)
+    if not 1 <= limit <= ELEMENT_SEARCH_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {ELEMENT_SEARCH_MAX_LIMIT}"}), 400
+    try:
+        return jsonify(search_incidents_by_element(query, limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/element/<element_name>', methods=['GET'])
 @swag_from({
     'tags': ['Incidents'],
     'summary': 'Get incident ID by element name',
@@ -435,7 +3452,7 @@ def get_incident_element(element_name):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/incidents/create/', methods=['POST'])
+@api.route('/incidents/create/', methods=['POST'])
 # @swag_from({
 #     'tags': ['Incidents'],
 #     'summary': 'Create a new incident',
@@ -465,12 +3482,19 @@ def get_incident_element(element_name):
 #         }
 #     ],
 #     'responses': {
+#         200: {
+#             'description': 'Incident already existed (same element, issue_type and start_date); new services '
+#                            'and the end date were merged into it'
+#         },
 #         201: {
 #             'description': 'Incident created successfully',
 #             'schema': {
 #                 'type': 'object',
 #                 'properties': {
 #                     'incident_id': {'type': 'integer'},
+#                     'created': {'type': 'boolean'},
+#                     'updated': {'type': 'boolean'},
+#                     'services_added': {'type': 'integer'},
 #                     'message': {'type': 'string'}
 #                 }
 #             }
@@ -499,7 +3523,8 @@ def create_incident():
         if not all(field in data for field in required_fields):
             return jsonify({"error": "Missing required fields"}), 400
 
-        incident_id = insert_database(
+        # Idempotente: reenviar o mesmo incidente (element, issue_type, start_date) não cria duplicatas
+        result = upsert_incident(
             element=data["element"],
             issue_type=data["issue_type"],
             start_date=data["start_date"],
@@ -507,11 +3532,159 @@ def create_incident():
             type_service=data["type_service"],
             services_affected=data["services_affected"]
         )
-        return jsonify({"incident_id": incident_id, "message": "Incident created successfully"}), 201
+        if result["created"]:
+            return jsonify(dict(result, message="Incident created successfully")), 201
+        message = "Incident already exists; updated" if result["updated"] else "Incident already exists"
+        return jsonify(dict(result, message=message)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/bulk', methods=['POST'])
+# @swag_from({
+#     'tags': ['Incidents'],
+#     'summary': 'Create incidents in bulk',
+#     'description': 'Creates many incidents in a single transaction. Accepts a JSON array or an NDJSON body '
+#                    '(one incident per line) with the same fields as /incidents/create/.',
+#     'consumes': ['application/json', 'application/x-ndjson'],
+#     'responses': {
+#         201: {'description': 'All incidents created or merged into existing ones (see "existing")'},
+#         207: {'description': 'Some incidents were rejected; see the per-item results'},
+#         400: {'description': 'Invalid body'},
+#         413: {'description': 'Too many items'},
+#         415: {'description': 'Unsupported media type'},
+#         500: {'description': 'Internal server error'}
+#     }
+# })
+def create_incidents_bulk():
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            try:
+                items = [current_app.json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            except ValueError:
+                return jsonify({"error": "Invalid NDJSON body"}), 400
+        elif request.is_json:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return jsonify({"error": "Expected a JSON array of incidents"}), 400
+        else:
+            return jsonify({"error": "Invalid data"}), 415
+
+        if not items:
+            return jsonify({"error": "No incidents provided"}), 400
+        if len(items) > BULK_MAX_ITEMS:
+            return jsonify({"error": f"At most {BULK_MAX_ITEMS} incidents per request"}), 413
+
+        results = bulk_insert_database(items)
+        failed = sum(1 for result in results if "error" in result)
+        created = sum(1 for result in results if result.get("created"))
+        return jsonify({
+            "created": created,
+            "existing": len(results) - failed - created,
+            "failed": failed,
+            "results": results
+        }), 201 if not failed else 207
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/incidents/update/', methods=['POST'])
+def _bulk_selection(data):
+    # Mesmos filtros de GET /incidents, mais uma lista de ids; sem nenhum filtro a operação é recusada
+    if not isinstance(data, dict):
+        return None, None, (jsonify({"error": "Expected a JSON object with ids and/or filters"}), 400)
+    ids = data.get("ids")
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return None, None, (jsonify({"error": "ids must be a list of integers"}), 400)
+    filters = {}
+    for field in INCIDENT_FILTER_FIELDS:
+        value = data.get(field)
+        if value is not None:
+            values = value if isinstance(value, list) else [value]
+            if not values or not all(isinstance(item, str) for item in values):
+                return None, None, (jsonify({"error": f"{field} must be a string or a list of strings"}), 400)
+            filters[field] = values
+    for name in INCIDENT_RANGE_FILTERS:
+        if data.get(name):
+            try:
+                filters[name] = datetime.fromisoformat(data[name])
+            except (TypeError, ValueError):
+                return None, None, (jsonify({"error": f"{name} must be an ISO 8601 date"}), 400)
+    if ids is None and not filters:
+        return None, None, (jsonify({"error": "Provide ids or at least one filter"}), 400)
+    return ids, filters, None
+
+@api.route('/incidents/bulk/close', methods=['POST'])
+# @swag_from({
+#     'tags': ['Incidents'],
+#     'summary': 'Close incidents in bulk',
+#     'description': 'Sets end_date on every ongoing incident matching ids and/or filters '
+#                    '(element, issue_type, type_service, start_date_from, start_date_to) in one statement.',
+#     'consumes': ['application/json'],
+#     'parameters': [
+#         {
+#             'name': 'body',
+#             'in': 'body',
+#             'required': True,
+#             'schema': {
+#                 'type': 'object',
+#                 'properties': {
+#                     'ids': {'type': 'array', 'items': {'type': 'integer'}, 'example': [1, 2]},
+#                     'element': {'type': 'string', 'example': 'Server A'},
+#                     'issue_type': {'type': 'array', 'items': {'type': 'string'}, 'example': ['Outage']},
+#                     'end_date': {'type': 'string', 'example': '2023-01-02 09:00'}
+#                 }
+#             }
+#         }
+#     ],
+#     'responses': {
+#         200: {'description': 'Number of incidents closed'},
+#         400: {'description': 'Invalid or missing filters'},
+#         415: {'description': 'Unsupported media type'},
+#         500: {'description': 'Internal server error'}
+#     }
+# })
+def close_incidents_bulk():
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Invalid data"}), 415
+        data = request.get_json(silent=True)
+        ids, filters, error = _bulk_selection(data)
+        if error:
+            return error
+        end_date = None
+        if data.get("end_date"):
+            try:
+                end_date = datetime.fromisoformat(data["end_date"])
+            except (TypeError, ValueError):
+                return jsonify({"error": "end_date must be an ISO 8601 date"}), 400
+        return jsonify(close_incidents(ids=ids, filters=filters, end_date=end_date)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/bulk/delete', methods=['POST'])
+# @swag_from({
+#     'tags': ['Incidents'],
+#     'summary': 'Delete incidents in bulk',
+#     'description': 'Deletes every incident matching ids and/or filters, with its affected services, '
+#                    'in a single statement.',
+#     'consumes': ['application/json'],
+#     'responses': {
+#         200: {'description': 'Number of incidents and affected services deleted'},
+#         400: {'description': 'Invalid or missing filters'},
+#         415: {'description': 'Unsupported media type'},
+#         500: {'description': 'Internal server error'}
+#     }
+# })
+def delete_incidents_bulk():
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Invalid data"}), 415
+        ids, filters, error = _bulk_selection(request.get_json(silent=True))
+        if error:
+            return error
+        return jsonify(delete_incidents(ids=ids, filters=filters)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@api.route('/incidents/update/', methods=['POST'])
 # @swag_from({
 #     'tags': ['Incidents'],
 #     'summary': 'Update an existing incident',
@@ -591,28 +3764,219 @@ def update_incident():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
-@app.route('/incidents/html', methods=['GET'])
+@api.route('/incidents/<int:incident_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'summary': 'Retrieve one incident',
+    'description': 'Returns the incident with its affected services and current version. '
+                   'The ETag header carries the version to send as If-Match on PATCH.',
+    'parameters': [
+        {
+            'name': 'incident_id',
+            'in': 'path',
+            'type': 'integer',
+            'required': True,
+            'description': 'The ID of the incident'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'The incident',
+            'headers': {'ETag': {'type': 'string', 'description': 'Incident version'}}
+        },
+        404: {
+            'description': 'Incident not found'
+        },
+        500: {
+            'description': 'Internal server error'
+        }
+    }
+})
+def get_incident(incident_id):
+    try:
+        incident = get_incident_by_id(incident_id)
+        if not incident:
+            return jsonify({"error": "Incident not found"}), 404
+        response = jsonify(incident)
+        response.set_etag(str(incident["version"]))
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _etag_version(tag):
+    # ETag de GET /incidents/<id> é a versão; comprimido, compress_response acrescenta "-<codificação>"
+    version, _, encoding = tag.partition("-")
+    if version.isdigit() and (not encoding or encoding in COMPRESSORS):
+        return int(version)
+    return None
+
+@api.route('/incidents/<int:incident_id>', methods=['PATCH'])
+# @swag_from({
+#     'tags': ['Incidents'],
+#     'summary': 'Partially update an incident',
+#     'description': 'Updates only the provided fields (end_date: null reopens the incident). '
+#                    'add_services/remove_services apply deltas; services_affected replaces the whole set. '
+#                    'Send If-Match with the ETag (or "version" in the body) to reject concurrent changes.',
+#     'consumes': ['application/json'],
+#     'parameters': [
+#         {
+#             'name': 'body',
+#             'in': 'body',
+#             'required': True,
+#             'schema': {
+#                 'type': 'object',
+#                 'properties': {
+#                     'element': {'type': 'string', 'example': 'Server B'},
+#                     'issue_type': {'type': 'string', 'example': 'Performance'},
+#                     'start_date': {'type': 'string', 'example': '2023-01-02 08:00'},
+#                     'end_date': {'type': 'string', 'example': '2023-01-02 09:00'},
+#                     'type_service': {'type': 'string', 'example': 'Database'},
+#                     'add_services': {'type': 'array', 'items': {'type': 'string'}, 'example': ['svc4']},
+#                     'remove_services': {'type': 'array', 'items': {'type': 'string'}, 'example': ['svc1']},
+#                     'services_affected': {'type': 'array', 'items': {'type': 'string'}},
+#                     'version': {'type': 'integer', 'example': 3}
+#                 }
+#             }
+#         }
+#     ],
+#     'responses': {
+#         200: {'description': 'Incident updated; ETag carries the new version'},
+#         400: {'description': 'Invalid data'},
+#         404: {'description': 'Incident not found'},
+#         412: {'description': 'The incident changed since the given version'},
+#         415: {'description': 'Unsupported media type'}
+#     }
+# })
+def patch_incident_route(incident_id):
+    try:
+        if not request.is_json:
+            return jsonify({"error": "Invalid data"}), 415
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+        service_keys = ("add_services", "remove_services", "services_affected")
+        unknown = sorted(set(data) - set(PATCH_FIELDS) - set(service_keys) - {"version"})
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+        if "services_affected" in data and ("add_services" in data or "remove_services" in data):
+            return jsonify({"error": "Use either services_affected or add_services/remove_services"}), 400
+        for key in service_keys:
+            if key in data and not isinstance(data[key], list):
+                return jsonify({"error": f"{key} must be a list"}), 400
+        fields = {name: data[name] for name in PATCH_FIELDS if name in data}
+        nullable = [name for name, value in fields.items() if value is None and name != "end_date"]
+        if nullable:
+            return jsonify({"error": f"Fields cannot be null: {', '.join(nullable)}"}), 400
+
+        # If-Match compara com as versões do incidente; "*" ou ausente não restringe
+        expected_versions = None
+        if request.if_match and not request.if_match.star_tag:
+            expected_versions = [_etag_version(tag) for tag in request.if_match.as_set()]
+            if not request.if_match.as_set() or None in expected_versions:
+                return jsonify({"error": "If-Match must carry the incident ETag (its version)"}), 400
+        elif data.get("version") is not None:
+            expected_versions = [data["version"]]
+
+        result = patch_incident(
+            incident_id,
+            fields,
+            add_services=data.get("add_services"),
+            remove_services=data.get("remove_services"),
+            services_affected=data.get("services_affected"),
+            expected_versions=expected_versions
+        )
+        if result is None:
+            return jsonify({"error": "Incident not found"}), 404
+        if result.get("conflict"):
+            response = jsonify({"error": "Incident was modified by another request", "version": result["version"]})
+            response.set_etag(str(result["version"]))
+            return response, 412
+        response = jsonify(dict(result, message="Incident updated successfully"))
+        response.set_etag(str(result["version"]))
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+HTML_PAGE_SIZE = int(os.getenv("HTML_PAGE_SIZE", "100"))
+
+class _HtmlPage:
+    # Consome no máximo `size` incidentes do stream; o item extra só indica se há próxima página
+    def __init__(self, rows, size):
+        self.rows = rows
+        self.size = size
+        self.has_next = False
+        # Executa a consulta antes de responder: erros de banco ainda viram um 500
+        self.first = next(rows, None)
+
+    def __iter__(self):
+        if self.first is None:
+            return
+        count = 0
+        for incident in chain([self.first], self.rows):
+            if count == self.size:
+                self.has_next = True
+                break
+            count += 1
+            yield incident
+        self.rows.close()
+
+def _buffered(chunks, size=16384):
+    # Agrupa os pedaços pequenos do Jinja antes de enviá-los
+    buffer, length = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+@api.route('/incidents/html', methods=['GET'])
 @swag_from({
     'tags': ['Incidents'],
     'summary': 'Render incidents as HTML',
-    'description': 'Returns an HTML page displaying all incidents.',
+    'description': 'Returns an HTML page displaying one page of incidents, streamed while the query runs.',
+    'parameters': [
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Page number (starts at 1)'},
+        {'name': 'size', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Incidents per page'},
+        {'name': 'element', 'in': 'query', 'type': 'string', 'required': False, 'description': 'Filter by element'},
+        {'name': 'issue_type', 'in': 'query', 'type': 'string', 'required': False, 'description': 'Filter by issue type'},
+        {'name': 'type_service', 'in': 'query', 'type': 'string', 'required': False, 'description': 'Filter by service type'},
+        {'name': 'active', 'in': 'query', 'type': 'boolean', 'required': False, 'description': 'Only ongoing incidents'}
+    ],
     'responses': {
         200: {
             'description': 'HTML page with incidents'
         },
+        400: {
+            'description': 'Invalid page or size'
+        },
         500: {
             'description': 'Internal server error'
         }
     }
 })
+@conditional_get
 def get_incidents_html():
     try:
-        data = get_incidents_data()
-        return render_template('incidents.html', incidents=data)
+        page = request.args.get('page', 1, type=int)
+        size = request.args.get('size', HTML_PAGE_SIZE, type=int)
+        if page < 1 or not 1 <= size <= INCIDENTS_MAX_PAGE_SIZE:
+            return f"Error: page must be >= 1 and size between 1 and {INCIDENTS_MAX_PAGE_SIZE}", 400
+        filters = {field: request.args[field] for field in INCIDENT_FILTER_FIELDS if request.args.get(field)}
+        active = request.args.get('active', '').lower() in ('1', 'true', 'yes')
+
+        rows = stream_incidents_data(limit=size + 1, offset=(page - 1) * size, active=active, filters=filters)
+        incidents = _HtmlPage(rows, size)
+        query = dict(filters, size=size, **({"active": "true"} if active else {}))
+        chunks = stream_template('incidents.html', incidents=incidents, page=page, query=query, filters=filters, active=active)
+        return Response(_buffered(chunks), mimetype='text/html')
     except Exception as e:
         return f"Error: {str(e)}", 500
 
-@app.route('/incidents/delete/<int:incident_id>', methods=['DELETE'])
+@api.route('/incidents/delete/<int:incident_id>', methods=['DELETE'])
 # @swag_from({
 #     'tags': ['Incidents'],
 #     'summary': 'Delete an incident',
@@ -653,5 +4017,174 @@ def delete_incident_route(incident_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Fábrica da aplicação. config sobrescreve os padrões vindos do ambiente, ex.:
+# create_app({"SWAGGER_ENABLED": False, "JSON_PROVIDER": "default", "TESTING": True})
+def create_app(config=None):
+    app = Flask(__name__, template_folder='templates', static_folder='static')
+    app.config.update(
+        SWAGGER_ENABLED=SWAGGER_ENABLED,
+        JSON_PROVIDER=JSON_PROVIDER,
+        JSON_DATETIME_FORMAT=JSON_DATETIME_FORMAT,
+        DB_CREATE_SCHEMA=DB_CREATE_SCHEMA,
+    )
+    app.config.update(config or {})
+
+    json_provider = app.config["JSON_PROVIDER"]
+    if json_provider == "orjson" and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson, mas o pacote orjson não está instalado")
+    if json_provider == "orjson" or (json_provider == "auto" and orjson is not None):
+        app.json = OrjsonProvider(app, datetime_format=app.config["JSON_DATETIME_FORMAT"])
+
+    app.register_blueprint(api)
+    if not logger.handlers:
+        logger.addHandler(default_handler)
+
+    if app.config["SWAGGER_ENABLED"]:
+        # A especificação só é montada quando /apispec_1.json é pedido
+        from flasgger import Swagger
+        Swagger(app, config=swagger_config, template=template)
+
+    if METRICS_ENABLED:
+        app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+        app.json.dumps = _timed_serialization(app.json.dumps)
+        app.json.response = _timed_serialization(app.json.response)
+
+    if app.config["DB_CREATE_SCHEMA"]:
+        create_database()
+    return app
+
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # `app` (gunicorn app:app, scripts existentes) é criado no primeiro acesso, não na importação
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _app_lock:
+        if "app" not in globals():
+            globals()["app"] = create_app()
+    return globals()["app"]
+
+# Servidor de produção: gunicorn pré-fork com workers multi-thread
+def available_cpus():
+    # os.cpu_count() enxerga as CPUs do host; num container valem o cpuset (afinidade) e a cota do cgroup v2
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # sem sched_getaffinity (macOS, Windows)
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+# Orçamento de conexões: cada worker tem o seu pool (DB_POOL_SIZE + DB_MAX_OVERFLOW) no primário e em cada
+# réplica, mais a conexão do LISTEN do feed SSE no primário. WEB_WORKERS × (DB_POOL_SIZE + DB_MAX_OVERFLOW + 1)
+# por instância precisa caber no max_connections do Postgres (DB_MAX_CONNECTIONS, só para o aviso do serve),
+# descontadas as outras instâncias e conexões administrativas. Por isso o padrão tem teto: mais vazão por
+# worker vem de WEB_THREADS, não de mais workers
+WEB_WORKERS_DEFAULT_MAX = 8
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(min(2 * available_cpus() + 1, WEB_WORKERS_DEFAULT_MAX))))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "4"))
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "1000"))
+WEB_MAX_REQUESTS_JITTER = int(os.getenv("WEB_MAX_REQUESTS_JITTER", "100"))
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "60"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+
+def serve(host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS, threads=WEB_THREADS,
+          max_requests=WEB_MAX_REQUESTS, max_requests_jitter=WEB_MAX_REQUESTS_JITTER):
+    from gunicorn.app.base import BaseApplication
+
+    # Herdado pelos workers (preload_app): conexões SSE nunca tomam todas as threads de um worker
+    event_hub.max_clients = min(SSE_MAX_CLIENTS, max(threads - SSE_RESERVED_THREADS, 0))
+
+    budget = workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW + 1)
+    if budget > DB_MAX_CONNECTIONS:
+        logger.warning("%d workers podem abrir até %d conexões no primário (DB_MAX_CONNECTIONS=%d); "
+                       "reduza WEB_WORKERS ou DB_POOL_SIZE/DB_MAX_OVERFLOW", workers, budget, DB_MAX_CONNECTIONS)
+
+    def post_fork(server, worker):
+        # Cada worker abre o seu próprio pool; conexões herdadas do master não são reutilizadas
+        dispose_engine()
+
+    options = {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        "max_requests": max_requests,
+        "max_requests_jitter": max_requests_jitter,
+        "timeout": WEB_TIMEOUT,
+        "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+        "preload_app": True,
+        "post_fork": post_fork,
+        "accesslog": "-",
+    }
+
+    class IncidentsApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return create_app()
+
+    IncidentsApplication().run()
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    parser = argparse.ArgumentParser(description="Incident Management API")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="Servidor de desenvolvimento do Flask (padrão)")
+    serve_parser = commands.add_parser("serve", help="Servidor de produção (gunicorn pré-fork)")
+    serve_parser.add_argument("--host", default=WEB_HOST)
+    serve_parser.add_argument("--port", type=int, default=WEB_PORT)
+    serve_parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    serve_parser.add_argument("--threads", type=int, default=WEB_THREADS)
+    serve_parser.add_argument("--max-requests", type=int, default=WEB_MAX_REQUESTS)
+    serve_parser.add_argument("--max-requests-jitter", type=int, default=WEB_MAX_REQUESTS_JITTER)
+    commands.add_parser("init-db", help="Cria o schema, as tabelas e os índices")
+    commands.add_parser("archive", help="Arquiva incidentes encerrados em historic_incidents")
+    commands.add_parser("check-indexes", help="Relata índices ausentes ou sem uso")
+    stats_parser = commands.add_parser("refresh-stats", help="Atualiza os rollups de estatísticas")
+    stats_parser.add_argument("--full", action="store_true", help="Recalcula todo o histórico")
+    export_parser = commands.add_parser("export", help="Exporta uma tabela via COPY (CSV, Parquet ou Arrow)")
+    export_parser.add_argument("table", choices=list(EXPORT_TABLES))
+    export_parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    export_parser.add_argument("--from", dest="start_date_from", type=datetime.fromisoformat,
+                               help="start_date inicial (ISO 8601, incluída)")
+    export_parser.add_argument("--to", dest="start_date_to", type=datetime.fromisoformat,
+                               help="start_date final (ISO 8601, excluída)")
+    export_parser.add_argument("--output", "-o", help="Arquivo de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+              max_requests=args.max_requests, max_requests_jitter=args.max_requests_jitter)
+    elif args.command == 'init-db':
+        create_database()
+    elif args.command == 'archive':
+        print(json.dumps(archive_incidents(), default=str))
+    elif args.command == 'check-indexes':
+        print(json.dumps(check_indexes(), indent=2, default=str))
+    elif args.command == 'refresh-stats':
+        print(json.dumps(refresh_incident_rollups(full=args.full), default=str))
+    elif args.command == 'export':
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        chunks = export_table(args.table, args.format, args.start_date_from, args.start_date_to)
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        except BrokenPipeError:
+            # Leitor fechou o pipe (ex.: | head): cancela o COPY e silencia o flush do stdout na saída
+            chunks.close()
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            if args.output:
+                output.close()
+    else:
+        create_app().run(host='0.0.0.0', port=8080, debug=True)
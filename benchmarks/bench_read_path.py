@@ -0,0 +1,99 @@
+# Compara o caminho de leitura antigo (objetos ORM + jsonify padrão) com o atual
+# (select() do Core + provedor JSON rápido) para GET /incidents.
+#
+# Uso: python benchmarks/bench_read_path.py [--seed 20000] [--repeat 5]
+# Usa o banco configurado no .env (DB_HOST, DB_PORT, ...).
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from flask.json.provider import DefaultJSONProvider
+
+import app as api
+from app import AffectedService, Incident
+
+
+def orm_incidents():
+    # Caminho anterior: hidrata Incident/AffectedService e reagrupa em dicts
+    Session, _ = api.connect_database()
+    session = Session()
+    try:
+        results = (session.query(Incident, AffectedService)
+                   .outerjoin(AffectedService, Incident.id == AffectedService.incident_id)
+                   .all())
+        incidents = {}
+        for incident, affected_service in results:
+            if incident.id not in incidents:
+                incidents[incident.id] = {
+                    "id": incident.id,
+                    "element": incident.element,
+                    "issue_type": incident.issue_type,
+                    "start_date": incident.start_date,
+                    "end_date": incident.end_date,
+                    "time_range": incident.time_range,
+                    "type_service": incident.type_service,
+                    "services_affected": []
+                }
+            if affected_service and affected_service.service_id:
+                incidents[incident.id]["services_affected"].append(affected_service.service_id)
+        return list(incidents.values())
+    finally:
+        session.close()
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def encode(provider, data):
+    with api.app.app_context():
+        return provider.response(data).get_data()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do caminho de leitura de GET /incidents")
+    parser.add_argument("--seed", type=int, default=0, help="Insere N incidentes sintéticos antes de medir")
+    parser.add_argument("--services", type=int, default=3, help="Serviços afetados por incidente sintético")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.seed:
+        for start in range(0, args.seed, api.BULK_MAX_ITEMS):
+            api.bulk_insert_database([
+                {
+                    "element": f"bench-{i}",
+                    "issue_type": "benchmark",
+                    "start_date": "2024-01-01 10:00",
+                    "type_service": "bench",
+                    "services_affected": [f"bench-{i}-{j}" for j in range(args.services)]
+                }
+                for i in range(start, min(start + api.BULK_MAX_ITEMS, args.seed))
+            ])
+
+    orm_query, orm_data = best_of(args.repeat, orm_incidents)
+    core_query, core_data = best_of(args.repeat, api.get_incidents_data)
+    default_encode, _ = best_of(args.repeat, encode, DefaultJSONProvider(api.app), orm_data)
+    fast_encode, _ = best_of(args.repeat, encode, api.app.json, core_data)
+
+    results = {
+        "incidents": len(core_data),
+        "json_provider": type(api.app.json).__name__,
+        "orm_query_s": round(orm_query, 4),
+        "core_query_s": round(core_query, 4),
+        "default_encode_s": round(default_encode, 4),
+        "fast_encode_s": round(fast_encode, 4),
+        "total_speedup": round((orm_query + default_encode) / (core_query + fast_encode), 2)
+    }
+    print(api.app.json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
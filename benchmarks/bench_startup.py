@@ -0,0 +1,85 @@
+# Mede o custo de subir um worker: importar app.py, create_app() e a primeira requisição, cada
+# repetição num processo Python novo (sem módulos em cache). Serve para pegar regressões de cold start.
+#
+# Uso: python benchmarks/bench_startup.py [--repeat 5] [--path /incidents?limit=1] [--docs]
+# A primeira requisição usa o banco configurado no .env (DB_HOST, DB_PORT, ...).
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def measure_once(path, docs):
+    # Roda no processo filho: tudo o que é medido aqui começa sem nada importado
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app as api
+    imported = time.perf_counter()
+    app = api.create_app({"SWAGGER_ENABLED": docs})
+    created = time.perf_counter()
+    client = app.test_client()
+    first = client.get(path)
+    first_done = time.perf_counter()
+    second = client.get(path)
+    second_done = time.perf_counter()
+    result = {
+        "import_s": imported - start,
+        "create_app_s": created - imported,
+        "first_request_s": first_done - created,
+        "second_request_s": second_done - first_done,
+        "status": [first.status_code, second.status_code],
+        "swagger_loaded": "flasgger" in sys.modules,
+    }
+    if docs:
+        spec_start = time.perf_counter()
+        client.get("/apispec_1.json")
+        result["first_apispec_s"] = time.perf_counter() - spec_start
+    return result
+
+
+def run_child(path, docs):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--path", path]
+    if docs:
+        command.append("--docs")
+    start = time.perf_counter()
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    # Inclui a inicialização do interpretador: é o que um worker novo realmente paga
+    result["process_s"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de cold start (importação e primeira requisição)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--path", default="/incidents?limit=1", help="Rota da primeira requisição")
+    parser.add_argument("--docs", action="store_true", help="Com o Swagger ligado (SWAGGER_ENABLED=true)")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_once(args.path, args.docs)))
+        return
+
+    runs = [run_child(args.path, args.docs) for _ in range(args.repeat)]
+    results = {
+        "repeat": args.repeat,
+        "path": args.path,
+        "docs": args.docs,
+        "status": runs[-1]["status"],
+        "swagger_loaded": runs[-1]["swagger_loaded"],
+    }
+    for key in ("import_s", "create_app_s", "first_request_s", "second_request_s", "first_apispec_s", "process_s"):
+        if key in runs[0]:
+            values = [run[key] for run in runs]
+            results[key] = {"median": round(statistics.median(values), 4), "min": round(min(values), 4)}
+    print(json.dumps(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# Suíte de carga reproduzível para todas as rotas de app.py.
+#
+#   python -m benchmarks.load seed --incidents 100000 --services 4 --truncate
+#   python -m benchmarks.load run --concurrency 16 --duration 30 --output run.json
+#   python -m benchmarks.load run --url http://127.0.0.1:8000 --server-pid <pid do gunicorn>
+#   python -m benchmarks.load replay captura.jsonl --concurrency 8
+#   python -m benchmarks.load compare base.json run.json
+#
+# Usa o banco configurado no .env (DB_HOST, DB_PORT, ...). Um Postgres local descartável serve:
+#   docker run -d --name incidents-bench -p 5432:5432 -e POSTGRES_PASSWORD=bench postgres:16
+#   DB_USER=postgres DB_PASSWORD=bench DB_HOST=127.0.0.1 DB_PORT=5432 DB_NAME=postgres
+#
+# Sem --url as requisições passam pelo test client do Flask no mesmo processo: não precisa de
+# servidor e conta as consultas SQL de cada requisição. Com --url mede o servidor real (gunicorn);
+# aí as consultas por requisição não são visíveis e o pico de RSS vem de --server-pid.
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+import app  # noqa: F401
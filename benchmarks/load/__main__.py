@@ -0,0 +1,104 @@
+import argparse
+import json
+import sys
+
+from . import dataset, report, runner, scenarios
+
+
+def _write(result, output):
+    text = json.dumps(result, indent=2, default=str)
+    if output:
+        with open(output, "w", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+    print(text)
+
+
+def _target(args):
+    return runner.HttpTarget(args.url) if args.url else runner.InProcessTarget()
+
+
+def cmd_seed(args):
+    data = dataset.Dataset(args.incidents, args.services, elements=args.elements, service_pool=args.service_pool,
+                           skew=args.skew, active_ratio=args.active_ratio, days=args.days, seed=args.random_seed)
+    inserted = dataset.seed(data, truncate_first=args.truncate)
+    _write({"seeded": inserted, "dataset": data.describe(), "tables": dataset.table_counts()}, None)
+
+
+def cmd_run(args):
+    mix = scenarios.Mix(scenarios.Context(dataset.sample_keys()), scenarios.parse_mix(args.mix))
+    target = _target(args)
+    samples, elapsed = runner.run_load(target, mix, args.concurrency, duration=args.duration, total=args.requests,
+                                       warmup=args.warmup, seed=args.random_seed)
+    _write(report.build_report("load", target, samples, elapsed, args.concurrency,
+                               runner.peak_rss(args.server_pid), mix=dict(zip(mix.names, mix.weights)),
+                               tables=dataset.table_counts()), args.output)
+
+
+def cmd_replay(args):
+    entries, skipped = runner.load_log(args.log)
+    if not entries:
+        print(f"{args.log}: no replayable requests ({skipped} lines without method/path)", file=sys.stderr)
+        return 1
+    target = _target(args)
+    samples, elapsed = runner.replay(target, entries, args.concurrency, preserve_timing=args.preserve_timing,
+                                     speed=args.speed)
+    _write(report.build_report("replay", target, samples, elapsed, args.concurrency,
+                               runner.peak_rss(args.server_pid), log=args.log, skipped_lines=skipped,
+                               tables=dataset.table_counts()), args.output)
+
+
+def cmd_compare(args):
+    with open(args.base, encoding="utf-8") as base, open(args.new, encoding="utf-8") as new:
+        _write(report.compare(json.load(base), json.load(new)), args.output)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load",
+                                     description="Benchmark de carga das rotas da API de incidentes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed", help="Insere uma massa sintética com distribuição assimétrica")
+    seed.add_argument("--incidents", type=int, default=10000, help="N incidentes")
+    seed.add_argument("--services", type=int, default=3, help="M serviços afetados por incidente")
+    seed.add_argument("--elements", type=int, help="Elementos distintos (padrão N/20)")
+    seed.add_argument("--service-pool", type=int, help="Serviços distintos (padrão N*M/10)")
+    seed.add_argument("--skew", type=float, default=1.1, help="Expoente Zipf de elementos e serviços")
+    seed.add_argument("--active-ratio", type=float, default=0.05, help="Fração de incidentes em andamento")
+    seed.add_argument("--days", type=int, default=365, help="Janela de start_date em dias")
+    seed.add_argument("--random-seed", type=int, default=42)
+    seed.add_argument("--truncate", action="store_true", help="Esvazia as tabelas antes de inserir")
+    seed.set_defaults(func=cmd_seed)
+
+    for name, func, help_text in (("run", cmd_run, "Executa a mistura de cenários em todas as rotas"),
+                                  ("replay", cmd_replay, "Reexecuta um log de requisições em JSON lines")):
+        command = commands.add_parser(name, help=help_text)
+        if name == "replay":
+            command.add_argument("log", help="Arquivo JSONL com method, path, headers, json/body e offset/ts")
+            command.add_argument("--preserve-timing", action="store_true", help="Respeita offset/ts do log")
+            command.add_argument("--speed", type=float, default=1.0, help="Multiplicador de velocidade do replay")
+        else:
+            command.add_argument("--duration", type=float, default=10.0, help="Segundos medidos")
+            command.add_argument("--requests", type=int, help="Para após N requisições medidas")
+            command.add_argument("--warmup", type=float, default=1.0, help="Segundos de aquecimento descartados")
+            command.add_argument("--mix", help="Pesos por cenário, ex.: incident_by_service=50,bulk=0 "
+                                               f"({', '.join(scenarios.SCENARIOS)})")
+            command.add_argument("--random-seed", type=int, default=42)
+        command.add_argument("--url", help="Servidor HTTP a medir; sem ele usa o test client no processo")
+        command.add_argument("--concurrency", type=int, default=8)
+        command.add_argument("--server-pid", type=int, action="append", default=[],
+                             help="PID do servidor (e filhos) para o pico de RSS")
+        command.add_argument("--output", help="Também grava o relatório JSON neste arquivo")
+        command.set_defaults(func=func)
+
+    compare = commands.add_parser("compare", help="Compara dois relatórios JSON")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--output")
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# Massa sintética: N incidentes × M serviços, com a assimetria de um ambiente real.
+# Poucos elementos e serviços concentram a maior parte dos incidentes (Zipf), os incidentes
+# recentes são mais densos e só uma fração continua em andamento.
+import contextlib
+import random
+import sys
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import func, select, text
+
+import app as api
+from app import AffectedService, Incident
+
+ISSUE_TYPES = [("fibra_rompida", 40), ("queda_energia", 25), ("degradacao", 20), ("manutencao", 10), ("outros", 5)]
+TYPE_SERVICES = [("fibra", 55), ("radio", 25), ("satelite", 5), ("cobre", 15)]
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def zipf_weights(size, exponent):
+    return list(accumulate(1 / rank ** exponent for rank in range(1, size + 1)))
+
+
+class Dataset:
+    def __init__(self, incidents, services, elements=None, service_pool=None, skew=1.1, active_ratio=0.05,
+                 days=365, seed=42, now=None):
+        self.incidents = incidents
+        self.services = services
+        self.elements = elements or max(incidents // 20, 1)
+        self.service_pool = max(service_pool or incidents * services // 10, services)
+        self.skew = skew
+        self.active_ratio = active_ratio
+        self.days = days
+        self.seed = seed
+        self.now = now or datetime(2024, 12, 31, 23, 0)
+        self._element_weights = zipf_weights(self.elements, skew)
+        self._service_weights = zipf_weights(self.service_pool, skew)
+
+    def element_name(self, rank):
+        return f"bench-element-{rank}"
+
+    def service_id(self, rank):
+        return f"bench-service-{rank}"
+
+    def pick_element(self, rng):
+        return self.element_name(rng.choices(range(self.elements), cum_weights=self._element_weights)[0])
+
+    def pick_services(self, rng, count):
+        # Amostra sem repetição dentro do incidente, preservando o peso dos serviços populares
+        picked = set()
+        while len(picked) < min(count, self.service_pool):
+            picked.update(rng.choices(range(self.service_pool), cum_weights=self._service_weights,
+                                      k=count - len(picked)))
+        return [self.service_id(rank) for rank in sorted(picked)]
+
+    def incident(self, rng):
+        # Datas concentradas no fim da janela: a distribuição triangular favorece os dias recentes
+        start = self.now - timedelta(days=rng.triangular(0, self.days, 0), minutes=rng.randrange(60))
+        end = None
+        if rng.random() >= self.active_ratio:
+            end = min(start + timedelta(hours=rng.expovariate(1 / 4)), self.now)
+        return {
+            "element": self.pick_element(rng),
+            "issue_type": rng.choices([name for name, _ in ISSUE_TYPES], [w for _, w in ISSUE_TYPES])[0],
+            "start_date": start.strftime(DATE_FORMAT),
+            "end_date": end.strftime(DATE_FORMAT) if end else None,
+            "type_service": rng.choices([name for name, _ in TYPE_SERVICES], [w for _, w in TYPE_SERVICES])[0],
+            "services_affected": self.pick_services(rng, self.services),
+        }
+
+    def generate(self):
+        rng = random.Random(self.seed)
+        for _ in range(self.incidents):
+            yield self.incident(rng)
+
+    def describe(self):
+        return {
+            "incidents": self.incidents,
+            "services_per_incident": self.services,
+            "elements": self.elements,
+            "service_pool": self.service_pool,
+            "skew": self.skew,
+            "active_ratio": self.active_ratio,
+            "days": self.days,
+            "seed": self.seed,
+        }
+
+
+def truncate():
+    _, engine = api.connect_database()
+    with engine.begin() as conn:
+        conn.execute(text(
+            "TRUNCATE network.affected_services, network.incidents, "
+            "network.historic_affected_services, network.historic_incidents RESTART IDENTITY"
+        ))
+
+
+def seed(dataset, truncate_first=False):
+    with contextlib.redirect_stdout(sys.stderr):
+        api.create_database()
+    if truncate_first:
+        truncate()
+    batch = []
+    inserted = 0
+    for item in dataset.generate():
+        batch.append(item)
+        if len(batch) == api.BULK_MAX_ITEMS:
+            inserted += _insert(batch)
+            batch = []
+    if batch:
+        inserted += _insert(batch)
+    # Estatísticas atualizadas antes de medir: o planner precisa conhecer a assimetria
+    _, engine = api.connect_database()
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+            text("ANALYZE network.incidents, network.affected_services"))
+    return inserted
+
+
+def _insert(batch):
+    results = api.bulk_insert_database(batch)
+    failed = [result for result in results if "error" in result]
+    if failed:
+        raise RuntimeError(f"{len(failed)} incidents failed to insert: {failed[0]['error']}")
+    return len(results)
+
+
+def table_counts():
+    _, engine = api.connect_database()
+    with engine.connect() as conn:
+        return {
+            "incidents": conn.execute(select(func.count()).select_from(Incident.__table__)).scalar(),
+            "affected_services": conn.execute(select(func.count()).select_from(AffectedService.__table__)).scalar(),
+        }
+
+
+def sample_keys(limit=5000):
+    # Chaves reais para montar as requisições: ids, elementos e serviços na proporção em que aparecem
+    _, engine = api.connect_database()
+    incidents = Incident.__table__
+    services = AffectedService.__table__
+    with engine.connect() as conn:
+        bounds = conn.execute(select(func.min(incidents.c.id), func.max(incidents.c.id))).one()
+        elements = conn.execute(select(incidents.c.element).order_by(func.random()).limit(limit)).scalars().all()
+        service_ids = conn.execute(select(services.c.service_id).order_by(func.random()).limit(limit)).scalars().all()
+        issue_types = conn.execute(select(incidents.c.issue_type).distinct()).scalars().all()
+    return {
+        "min_id": bounds[0] or 0,
+        "max_id": bounds[1] or 0,
+        "elements": elements or ["bench-element-0"],
+        "service_ids": service_ids or ["bench-service-0"],
+        "issue_types": issue_types or ["fibra_rompida"],
+    }
@@ -0,0 +1,105 @@
+# Resumo em JSON (vazão, percentis de latência, consultas por requisição) e comparação entre execuções.
+import math
+import platform
+import subprocess
+from collections import Counter, defaultdict
+
+import app as api
+
+
+def percentile(ordered, pct):
+    # Nearest-rank: sempre um valor observado, estável entre execuções
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample.latency * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    statuses = Counter(str(sample.status) for sample in samples)
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample.status == 0 or sample.status >= 500),
+        "status": dict(sorted(statuses.items())),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": _round(percentile(latencies, 50)),
+            "p95": _round(percentile(latencies, 95)),
+            "p99": _round(percentile(latencies, 99)),
+            "max": _round(latencies[-1] if latencies else None),
+        },
+        "db_queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2),
+            "max": max(queries),
+        } if queries else None,
+        "response_bytes_mean": round(sum(sample.size for sample in samples) / len(samples)) if samples else None,
+    }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def build_report(kind, target, samples, elapsed, concurrency, rss, **extra):
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample.name].append(sample)
+    errors = [sample.error for sample in samples if sample.error]
+    return {
+        "benchmark": kind,
+        "target": target.name,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "environment": _environment(),
+        **extra,
+        "total": summarize(samples, elapsed),
+        # Vazão por rota é a fatia da rota no mesmo intervalo, não a capacidade isolada dela
+        "routes": {name: summarize(route, elapsed) for name, route in sorted(by_route.items())},
+        "peak_rss": rss,
+        "sample_errors": sorted(Counter(errors).items(), key=lambda item: -item[1])[:10],
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "json_provider": type(api.app.json).__name__,
+        "db_pool_size": api.DB_POOL_SIZE,
+        "git_commit": commit,
+    }
+
+
+def compare(base, new):
+    # Razão de vazão e variação percentual das latências, por rota presente nas duas execuções
+    def delta(before, after):
+        if not before or after is None:
+            return None
+        return round((after - before) / before * 100, 1)
+
+    def diff(old, current):
+        return {
+            "throughput_ratio": round(current["throughput_rps"] / old["throughput_rps"], 3)
+            if old["throughput_rps"] and current["throughput_rps"] is not None else None,
+            **{f"{pct}_change_pct": delta(old["latency_ms"][pct], current["latency_ms"][pct])
+               for pct in ("p50", "p95", "p99")},
+            "db_queries_change": round(current["db_queries_per_request"]["mean"]
+                                       - old["db_queries_per_request"]["mean"], 2)
+            if old["db_queries_per_request"] and current["db_queries_per_request"] else None,
+        }
+
+    routes = sorted(set(base["routes"]) & set(new["routes"]))
+    return {
+        "base": base["environment"].get("git_commit"),
+        "new": new["environment"].get("git_commit"),
+        "total": diff(base["total"], new["total"]),
+        "routes": {name: diff(base["routes"][name], new["routes"][name]) for name in routes},
+        "only_in_base": sorted(set(base["routes"]) - set(new["routes"])),
+        "only_in_new": sorted(set(new["routes"]) - set(base["routes"])),
+    }
@@ -0,0 +1,247 @@
+# Alvos (test client no processo ou servidor HTTP real), workers concorrentes e replay de logs.
+import http.client
+import json
+import os
+import queue
+import random
+import resource
+import threading
+import time
+from dataclasses import dataclass
+from itertools import count
+from urllib.parse import urlsplit
+
+from sqlalchemy import event
+from werkzeug.exceptions import HTTPException
+
+import app as api
+
+from .scenarios import BenchRequest
+
+
+@dataclass
+class Sample:
+    name: str
+    status: int
+    latency: float
+    queries: int = None
+    size: int = 0
+    error: str = None
+
+
+class InProcessTarget:
+    def __init__(self):
+        self.name = "in-process"
+        self.local = threading.local()
+        # Contador por thread: o archiver e o ouvinte de eventos não entram na conta das requisições
+        event.listen(api.get_engine(), "before_cursor_execute", self._count_query)
+
+    def _count_query(self, *args):
+        self.local.queries = getattr(self.local, "queries", 0) + 1
+
+    def send(self, request):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = api.app.test_client()
+        self.local.queries = 0
+        response = client.open(request.path, method=request.method, json=request.json, data=request.data,
+                               headers=request.headers)
+        try:
+            # Consome o corpo inteiro: respostas em streaming só terminam aqui
+            body = response.get_data()
+            return response.status_code, body, self.local.queries
+        finally:
+            response.close()
+
+
+class HttpTarget:
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self.name = url
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def send(self, request):
+        headers = dict(request.headers)
+        body = request.data.encode() if request.data is not None else None
+        if request.json is not None:
+            body = json.dumps(request.json).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            # Uma conexão keep-alive por worker; reconecta uma vez se o servidor a fechou
+            connection = getattr(self.local, "connection", None)
+            if connection is None:
+                connection = self.local.connection = self.connection_class(self.netloc, timeout=self.timeout)
+            try:
+                connection.request(request.method, self.prefix + request.path, body, headers)
+                response = connection.getresponse()
+                return response.status, response.read(), None
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self.local.connection = None
+                if attempt:
+                    raise
+
+
+def _execute(target, request):
+    start = time.perf_counter()
+    try:
+        status, body, queries = target.send(request)
+    except Exception as e:
+        return Sample(request.name, 0, time.perf_counter() - start, error=str(e))
+    sample = Sample(request.name, status, time.perf_counter() - start, queries, len(body))
+    if request.on_response is not None and status < 300:
+        try:
+            request.on_response(status, json.loads(body))
+        except ValueError:
+            pass
+    return sample
+
+
+def run_load(target, mix, concurrency, duration=None, total=None, warmup=0.0, seed=42):
+    # Para no que vier primeiro: duração (após o aquecimento) ou número total de requisições
+    budget = count()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration if duration else None
+    results = [[] for _ in range(concurrency)]
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        samples = results[index]
+        while True:
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                return
+            measured = now >= measure_from
+            if measured and total is not None and next(budget) >= total:
+                return
+            sample = _execute(target, mix.next(rng))
+            if measured:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for samples in results for sample in samples], time.perf_counter() - max(measure_from, started)
+
+
+def load_log(path):
+    # Uma requisição por linha: {"method", "path" ou "url", "headers", "json" ou "body", "offset" ou "ts"}.
+    # Linhas sem path (como os pedidos de requests.jsonl) são contadas como ignoradas
+    adapter = api.app.url_map.bind("localhost")
+    entries, skipped = [], 0
+    first_ts = None
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            target = record.get("path") or record.get("url") if isinstance(record, dict) else None
+            if not target:
+                skipped += 1
+                continue
+            parts = urlsplit(target)
+            path = parts.path + (f"?{parts.query}" if parts.query else "")
+            method = record.get("method", "GET").upper()
+            try:
+                rule, _ = adapter.match(parts.path, method=method, return_rule=True)
+                name = f"{method} {rule.rule}"
+            except HTTPException:
+                name = f"{method} (unmatched)"
+            body = record.get("json", record.get("body"))
+            if isinstance(body, str):
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    pass
+            if "offset" in record:
+                offset = float(record["offset"])
+            elif "ts" in record:
+                first_ts = float(record["ts"]) if first_ts is None else first_ts
+                offset = float(record["ts"]) - first_ts
+            else:
+                offset = None
+            entries.append((offset, BenchRequest(
+                name, method, path,
+                json=body if not isinstance(body, str) else None,
+                data=body if isinstance(body, str) else None,
+                headers=record.get("headers") or {},
+            )))
+    return entries, skipped
+
+
+def replay(target, entries, concurrency, preserve_timing=False, speed=1.0):
+    # Sem preserve_timing o log é consumido o mais rápido possível pelos workers
+    pending = queue.Queue()
+    results = [[] for _ in range(concurrency)]
+
+    def worker(index):
+        while True:
+            request = pending.get()
+            if request is None:
+                return
+            results[index].append(_execute(target, request))
+
+    threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for offset, request in entries:
+        if preserve_timing and offset is not None:
+            delay = started + offset / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        pending.put(request)
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    return [sample for samples in results for sample in samples], time.perf_counter() - started
+
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as handle:
+                children.extend(int(child) for child in handle.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _peak_rss_kb(pid):
+    # VmHWM: maior RSS desde o início do processo (Linux)
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def peak_rss(server_pids=()):
+    report = {"benchmark_process_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    pids = []
+    pending = list(server_pids)
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(_children(pid))
+    values = [value for value in map(_peak_rss_kb, pids) if value is not None]
+    if values:
+        # Com gunicorn: o pid do master inclui os workers
+        report.update(server_max_kb=max(values), server_total_kb=sum(values), server_processes=len(values))
+    return report
@@ -0,0 +1,235 @@
+# Mistura de requisições que cobre todas as rotas de app.py.
+# Cada cenário monta uma requisição a partir das chaves amostradas do banco; os de escrita só
+# alteram ou removem incidentes criados pelo próprio benchmark, então a massa medida não muda.
+# GET /incidents/stream fica de fora: a conexão SSE não termina e não tem latência por requisição.
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from .dataset import DATE_FORMAT, TYPE_SERVICES
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+@dataclass
+class BenchRequest:
+    name: str
+    method: str
+    path: str
+    json: object = None
+    data: str = None
+    headers: dict = field(default_factory=dict)
+    on_response: object = None
+
+
+class Context:
+    def __init__(self, keys):
+        self.keys = keys
+        self.created = deque(maxlen=10000)
+
+    def remember(self, status, body):
+        if status == 201 and body:
+            self.created.append(body.get("incident_id"))
+
+    def take_created(self):
+        try:
+            return self.created.popleft()
+        except IndexError:
+            return None
+
+    def new_incident(self, rng):
+        start = datetime(2024, 12, 31) - timedelta(minutes=rng.randrange(60 * 24 * 30))
+        return {
+            "element": rng.choice(self.keys["elements"]),
+            "issue_type": rng.choice(self.keys["issue_types"]),
+            "start_date": start.strftime(DATE_FORMAT),
+            "type_service": rng.choice(TYPE_SERVICES)[0],
+            "services_affected": rng.sample(self.keys["service_ids"], min(3, len(self.keys["service_ids"]))),
+        }
+
+    def random_id(self, rng):
+        return rng.randint(self.keys["min_id"], max(self.keys["max_id"], self.keys["min_id"]))
+
+
+def home(ctx, rng):
+    return BenchRequest("GET /", "GET", "/")
+
+
+def incidents_page(ctx, rng):
+    return BenchRequest("GET /incidents?limit", "GET", f"/incidents?limit=100&after={ctx.random_id(rng)}")
+
+
+def incidents_filtered(ctx, rng):
+    issue_types = ",".join(rng.sample(ctx.keys["issue_types"], min(2, len(ctx.keys["issue_types"]))))
+    return BenchRequest("GET /incidents?filters", "GET",
+                        f"/incidents?issue_type={issue_types}&start_date_from=2024-12-01"
+                        f"&sort=-start_date&limit=100&fields=id,element,start_date")
+
+
+def incidents_ndjson(ctx, rng):
+    return BenchRequest("GET /incidents (ndjson)", "GET", f"/incidents?limit=1000&after={ctx.random_id(rng)}",
+                        headers=NDJSON)
+
+
+def incidents_full(ctx, rng):
+    return BenchRequest("GET /incidents", "GET", "/incidents")
+
+
+def incidents_active(ctx, rng):
+    return BenchRequest("GET /incidents/active", "GET", "/incidents/active?limit=100")
+
+
+def incident_by_service(ctx, rng):
+    return BenchRequest("GET /incidents/service/<id>", "GET", f"/incidents/service/{rng.choice(ctx.keys['service_ids'])}")
+
+
+def services_lookup(ctx, rng):
+    service_ids = rng.sample(ctx.keys["service_ids"], min(20, len(ctx.keys["service_ids"])))
+    return BenchRequest("POST /incidents/services/lookup", "POST", "/incidents/services/lookup",
+                        json={"service_ids": service_ids})
+
+
+def incident_by_element(ctx, rng):
+    return BenchRequest("GET /incidents/element/<name>", "GET", f"/incidents/element/{rng.choice(ctx.keys['elements'])}")
+
+
+def element_search(ctx, rng):
+    # Prefixo de um elemento existente, como um operador digitando parte do hostname
+    element = rng.choice(ctx.keys["elements"])
+    query = element[:rng.randint(3, max(len(element), 3))]
+    return BenchRequest("GET /incidents/search/element", "GET", f"/incidents/search/element?q={query}")
+
+
+def incidents_html(ctx, rng):
+    return BenchRequest("GET /incidents/html", "GET", f"/incidents/html?page={rng.randint(1, 20)}")
+
+
+def stats(ctx, rng):
+    return BenchRequest("GET /incidents/stats", "GET", "/incidents/stats")
+
+
+def stats_timeseries(ctx, rng):
+    return BenchRequest("GET /incidents/stats/timeseries", "GET",
+                        f"/incidents/stats/timeseries?interval=week&issue_type={rng.choice(ctx.keys['issue_types'])}")
+
+
+def stats_top(ctx, rng):
+    return BenchRequest("GET /incidents/stats/top", "GET",
+                        f"/incidents/stats/top?by={rng.choice(['element', 'service_id'])}&order=mttr")
+
+
+def cache_stats(ctx, rng):
+    return BenchRequest("GET /cache/stats", "GET", "/cache/stats")
+
+
+def create(ctx, rng):
+    return BenchRequest("POST /incidents/create/", "POST", "/incidents/create/", json=ctx.new_incident(rng),
+                        on_response=ctx.remember)
+
+
+def bulk(ctx, rng):
+    return BenchRequest("POST /incidents/bulk", "POST", "/incidents/bulk",
+                        json=[ctx.new_incident(rng) for _ in range(20)])
+
+
+def update(ctx, rng):
+    incident_id = ctx.take_created()
+    if incident_id is None:
+        return None
+    ctx.created.append(incident_id)
+    return BenchRequest("POST /incidents/update/", "POST", "/incidents/update/", json={
+        "incident_id": incident_id,
+        "end_date": "2024-12-31 23:59",
+        "services_affected": rng.sample(ctx.keys["service_ids"], min(2, len(ctx.keys["service_ids"]))),
+    })
+
+
+def incident_by_id(ctx, rng):
+    return BenchRequest("GET /incidents/<id>", "GET", f"/incidents/{ctx.random_id(rng)}")
+
+
+def patch(ctx, rng):
+    incident_id = ctx.take_created()
+    if incident_id is None:
+        return None
+    ctx.created.append(incident_id)
+    service_ids = rng.sample(ctx.keys["service_ids"], min(2, len(ctx.keys["service_ids"])))
+    return BenchRequest("PATCH /incidents/<id>", "PATCH", f"/incidents/{incident_id}",
+                        json={"add_services": service_ids[:1], "remove_services": service_ids[1:]})
+
+
+def bulk_close(ctx, rng):
+    incident_ids = [incident_id for incident_id in (ctx.take_created() for _ in range(5)) if incident_id is not None]
+    if not incident_ids:
+        return None
+    ctx.created.extend(incident_ids)
+    return BenchRequest("POST /incidents/bulk/close", "POST", "/incidents/bulk/close", json={"ids": incident_ids})
+
+
+def bulk_delete(ctx, rng):
+    incident_ids = [incident_id for incident_id in (ctx.take_created() for _ in range(5)) if incident_id is not None]
+    if not incident_ids:
+        return None
+    return BenchRequest("POST /incidents/bulk/delete", "POST", "/incidents/bulk/delete", json={"ids": incident_ids})
+
+
+def delete(ctx, rng):
+    incident_id = ctx.take_created()
+    if incident_id is None:
+        return None
+    return BenchRequest("DELETE /incidents/delete/<id>", "DELETE", f"/incidents/delete/{incident_id}")
+
+
+# Pesos padrão: leitura pontual domina, listagens completas e escritas em lote são raras
+SCENARIOS = {
+    "home": (home, 1),
+    "incidents_page": (incidents_page, 10),
+    "incidents_filtered": (incidents_filtered, 5),
+    "incidents_ndjson": (incidents_ndjson, 2),
+    "incidents_full": (incidents_full, 1),
+    "incidents_active": (incidents_active, 5),
+    "incident_by_service": (incident_by_service, 20),
+    "services_lookup": (services_lookup, 5),
+    "incident_by_element": (incident_by_element, 10),
+    "element_search": (element_search, 3),
+    "incidents_html": (incidents_html, 3),
+    "stats": (stats, 2),
+    "stats_timeseries": (stats_timeseries, 1),
+    "stats_top": (stats_top, 1),
+    "cache_stats": (cache_stats, 1),
+    "create": (create, 4),
+    "bulk": (bulk, 1),
+    "incident_by_id": (incident_by_id, 5),
+    "update": (update, 3),
+    "patch": (patch, 3),
+    "delete": (delete, 3),
+    "bulk_close": (bulk_close, 1),
+    "bulk_delete": (bulk_delete, 1),
+}
+
+
+def parse_mix(spec):
+    # "incident_by_service=50,create=0": sobrescreve pesos; peso 0 desliga o cenário
+    weights = {name: weight for name, (_, weight) in SCENARIOS.items()}
+    for part in filter(None, (spec or "").split(",")):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+class Mix:
+    def __init__(self, ctx, weights):
+        self.ctx = ctx
+        self.names = list(weights)
+        self.weights = [weights[name] for name in self.names]
+
+    def next(self, rng):
+        # Cenários sobre incidentes criados devolvem None enquanto nenhum incidente foi criado: sorteia outro cenário
+        for _ in range(100):
+            name = rng.choices(self.names, self.weights)[0]
+            request = SCENARIOS[name][0](self.ctx, rng)
+            if request is not None:
+                return request
+        raise RuntimeError("update, patch and delete scenarios need the create scenario enabled")